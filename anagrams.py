@@ -2,9 +2,18 @@
 Anagrams.
 '''
 
+import bisect
+import itertools
+import time
+from functools import lru_cache
+
+from instrument import current_stats, timed
+from lexicon import current_lexicon
 from word_game import find_words, removed
+from workers import lexicon_pool, ordered_map
 
 
+@timed()
 def anagrams(phrase, shortest=2):
     """Return a set of phrases with words from WORDS that form anagram
     of phrase. Spaces can be anywhere in phrase or anagram. All words
@@ -17,6 +26,8 @@ def find_anagram(letters, shortest, pre=None):
     "Using letters, from anagrams using words >= previous_word and longer than shortest."
     if pre is None:
         pre = ''
+    stats = current_stats()
+    if stats: stats.count('nodes')
     results = set()
     for word in find_words(letters):
         if len(word) >= shortest and word >= pre:
@@ -29,6 +40,189 @@ def find_anagram(letters, shortest, pre=None):
     return results
 
 
+PRIMES = dict(zip('ABCDEFGHIJKLMNOPQRSTUVWXYZ', [
+    2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71,
+    73, 79, 83, 89, 97, 101
+]))
+OTHER = 103  # for characters that no word can use
+
+
+def signature(letters):
+    """A multiset of letters as the product of one prime per letter. Equal
+    multisets have equal signatures; word fits in letters exactly when
+    signature(word) divides signature(letters), and the quotient is the
+    signature of what is left."""
+    product = 1
+    for L in letters:
+        product *= PRIMES.get(L, OTHER)
+    return product
+
+
+class AnagramSolver(object):
+    """Anagram sub-problems for one phrase. A sub-problem is the remaining
+    letters (as a signature, which stands for the sorted remainder) and the
+    index of the lowest word allowed next; each is solved once. The words
+    that fit a remainder are found by filtering the (shorter) list that fit
+    the remainder it came from."""
+
+    def __init__(self, phrase, shortest=2):
+        letters = phrase.replace(' ', '')
+        self.words = sorted(word for word in find_words(letters)
+                            if len(word) >= shortest)
+        self.signatures = [signature(word) for word in self.words]
+        self.letters = signature(letters)
+        self.fitting = {self.letters: range(len(self.words))}
+        self.phrase_memo = {}
+        self.count_memo = {}
+
+    def fits(self, remainder, candidates):
+        "Indexes of the words that fit in remainder, taken from candidates."
+        if remainder not in self.fitting:
+            signatures = self.signatures
+            self.fitting[remainder] = [
+                k for k in candidates if remainder % signatures[k] == 0]
+        return self.fitting[remainder]
+
+    def steps(self, remainder, lo):
+        """For each fitting words[k] with k >= lo, yield (k, word, rest), where
+        rest is the signature of remainder without word (1 if nothing)."""
+        candidates = self.fitting[remainder]
+        for k in candidates[bisect.bisect_left(candidates, lo):]:
+            rest = remainder // self.signatures[k]
+            if rest != 1:
+                self.fits(rest, candidates)
+            yield k, self.words[k], rest
+
+    def phrases(self, remainder=None, lo=0):
+        "Tuples of words, each >= words[lo], that use up exactly remainder."
+        if remainder is None: remainder = self.letters
+        key = (remainder, lo)
+        if key not in self.phrase_memo:
+            results = []
+            for k, word, rest in self.steps(remainder, lo):
+                if rest != 1:
+                    results.extend(
+                        (word, ) + more for more in self.phrases(rest, k))
+                else:
+                    results.append((word, ))
+            self.phrase_memo[key] = tuple(results)
+        return self.phrase_memo[key]
+
+    def count(self, remainder=None, lo=0):
+        """The number of tuples self.phrases(remainder, lo) would make. The
+        counts for every lo are kept per remainder, as running totals over
+        the fitting words from the last one back."""
+        if remainder is None: remainder = self.letters
+        candidates = self.fitting[remainder]
+        if remainder not in self.count_memo:
+            totals = [0] * (len(candidates) + 1)
+            for p in range(len(candidates) - 1, -1, -1):
+                k = candidates[p]
+                rest = remainder // self.signatures[k]
+                if rest != 1:
+                    self.fits(rest, candidates)
+                    totals[p] = totals[p + 1] + self.count(rest, k)
+                else:
+                    totals[p] = totals[p + 1] + 1
+            self.count_memo[remainder] = totals
+        return self.count_memo[remainder][bisect.bisect_left(candidates, lo)]
+
+    def generate(self, min_words=1, max_words=None, required=(),
+                 deadline=None):
+        """Generate tuples of words that use up the phrase's letters, in
+        lexicographic order, as they are found. Each has between min_words
+        and max_words words and includes all the required words. Stop early
+        once time.monotonic() passes deadline."""
+        dead = set()  # sub-problems known to have no solutions
+        expired = []
+
+        def search(remainder, lo, depth, required):
+            key = (remainder, lo, depth, required)
+            if key in dead:
+                return
+            if deadline is not None and time.monotonic() > deadline:
+                expired.append(True)
+            if expired or (max_words is not None and depth >= max_words):
+                return
+            found = False
+            if remainder % signature(''.join(required)) == 0:
+                candidates = self.fitting[remainder]
+                # Words come in order, so none may pass the first required one.
+                hi = (bisect.bisect_right(self.words, required[0])
+                      if required else len(self.words))
+                for k in candidates[bisect.bisect_left(candidates, lo):
+                                    bisect.bisect_left(candidates, hi)]:
+                    word = self.words[k]
+                    rest = remainder // self.signatures[k]
+                    more = (required[1:]
+                            if required and word == required[0] else required)
+                    if rest == 1:
+                        if not more and depth + 1 >= min_words:
+                            found = True
+                            yield (word, )
+                    else:
+                        self.fits(rest, candidates)
+                        for words in search(rest, k, depth + 1, more):
+                            found = True
+                            yield (word, ) + words
+            if not found and not expired:
+                dead.add(key)
+
+        return search(self.letters, 0, 0, tuple(sorted(required)))
+
+
+def iter_anagrams(phrase, shortest=2, max_results=None, min_words=1,
+                  max_words=None, required=(), deadline=None):
+    """Generate the phrases of anagrams(phrase, shortest) in sorted order,
+    without holding them all: at most max_results of them, each with
+    min_words to max_words words, including every word in required. Stops
+    when time.monotonic() passes deadline."""
+    solver = AnagramSolver(phrase, shortest)
+    phrases = (' '.join(words) for words in solver.generate(
+        min_words, max_words, [word.upper() for word in required], deadline))
+    return itertools.islice(phrases, max_results)
+
+
+def memo_anagrams(phrase, shortest=2):
+    """The same set as anagrams(phrase, shortest), but each sub-problem
+    is solved only once."""
+    return set(' '.join(words)
+               for words in AnagramSolver(phrase, shortest).phrases())
+
+
+def count_anagrams(phrase, shortest=2):
+    "The number of phrases in anagrams(phrase, shortest), without making them."
+    return AnagramSolver(phrase, shortest).count()
+
+
+@lru_cache(maxsize=16)
+def cached_solver(phrase, shortest, lexicon):
+    "An AnagramSolver kept for the tasks of one phrase that share a worker."
+    return AnagramSolver(phrase, shortest)
+
+
+def anagrams_starting(phrase, shortest, k):
+    "The phrases (in order) of the anagrams of phrase that start with words[k]."
+    solver = cached_solver(phrase, shortest, current_lexicon())
+    rest = solver.letters // solver.signatures[k]
+    word = solver.words[k]
+    if rest == 1:
+        return [word]
+    solver.fits(rest, solver.fitting[solver.letters])
+    return [' '.join((word, ) + words) for words in solver.phrases(rest, k)]
+
+
+def parallel_anagrams(phrase, shortest=2, workers=None):
+    """Generate the phrases of anagrams(phrase, shortest) in sorted order.
+    Each candidate first word is a separate task for a pool of worker
+    processes; results are streamed back in order of first word."""
+    solver = AnagramSolver(phrase, shortest)
+    tasks = [(phrase, shortest, k) for k in solver.fitting[solver.letters]]
+    with lexicon_pool(workers) as pool:
+        for phrases in ordered_map(pool, anagrams_starting, tasks):
+            yield from phrases
+
+
 def test():
     "tests."
     assert 'IT IT SEEN' in anagrams('ENTITIES')
@@ -42,8 +236,33 @@ def test():
         'CON PI THY', 'HYP NO TIC', 'COY NTH PI', 'CON HYP IT', 'COT HYP IN',
         'CON HYP TI'
     ])
+    for phrase in ['PYTHONIC', 'TORCHWOOD', 'OCTOBER SKY', 'ENTITIES']:
+        assert memo_anagrams(phrase) == anagrams(phrase)
+        assert count_anagrams(phrase) == len(anagrams(phrase))
+    assert memo_anagrams('ELVIS', 3) == anagrams('ELVIS', 3)
+    assert count_anagrams('ELECTRONIC MAIL') == 16702
+    test_iter_anagrams()
+    assert list(parallel_anagrams('PYTHONIC', workers=2)) == sorted(
+        anagrams('PYTHONIC'))
     print('tests pass')
 
 
+def test_iter_anagrams():
+    "The streaming generator agrees with anagrams() under each option."
+    every = sorted(anagrams('PYTHONIC'))
+    assert list(iter_anagrams('PYTHONIC')) == every
+    assert list(iter_anagrams('PYTHONIC', max_results=3)) == every[:3]
+    assert list(iter_anagrams('PYTHONIC', max_words=2)) == [
+        p for p in every if p.count(' ') < 2]
+    assert list(iter_anagrams('PYTHONIC', min_words=3)) == [
+        p for p in every if p.count(' ') >= 2]
+    assert list(iter_anagrams('PYTHONIC', required=['hyp', 'IN'])) == [
+        'COT HYP IN']
+    assert list(iter_anagrams('PYTHONIC', required=['THY', 'THY'])) == []
+    assert list(iter_anagrams('PYTHONIC', deadline=time.monotonic())) == []
+    assert next(iter_anagrams('DORMITORY ROOMS')) == min(
+        memo_anagrams('DORMITORY ROOMS'))
+
+
 if __name__ == '__main__':
     test()
@@ -0,0 +1,107 @@
+'''
+Batch solving: JSONL tasks in, JSONL results out.
+
+    python batch.py [FILE] [--output FILE] [--workers N] [--chunksize N]
+
+Each line of FILE (default stdin) is a task, in the form of a service
+request: {"id": 7, "op": "boggle_words", "args": {"board": "TEST ..."}},
+with op one of service.OPS. Each task gets one line of output, in input
+order: {"id": 7, "result": [...]} or {"id": 7, "error": "..."}; a bad
+task does not stop the batch. Tasks are read only as fast as they are
+solved, a few chunks ahead, so memory stays the same however long the
+input is.
+'''
+import json
+import sys
+from itertools import islice
+
+from service import solve
+from workers import lexicon_pool, ordered_map
+
+
+def answer(line):
+    "The JSON line that answers one task line."
+    id = None
+    try:
+        task = json.loads(line)
+        if not isinstance(task, dict):
+            raise ValueError('a task must be a JSON object')
+        id = task.get('id')
+        response = dict(id=id, result=solve(task['op'], task.get('args', {})))
+    except Exception as e:
+        response = dict(id=id, error='%s: %s' % (type(e).__name__, e))
+    return json.dumps(response)
+
+
+def answer_chunk(lines):
+    return [answer(line) for line in lines]
+
+
+def run_batch(lines, workers=None, chunksize=64, window=None):
+    """Generate the answer to each task in lines (skipping blank ones), in
+    order. With workers, chunks of tasks are solved by a process pool, with
+    at most window chunks in flight (see ordered_map); workers=0 solves them
+    here, one at a time."""
+    tasks = (line for line in lines if line.strip())
+    if workers == 0:
+        for line in tasks:
+            yield answer(line)
+        return
+    chunks = iter(lambda: list(islice(tasks, chunksize)), [])
+    with lexicon_pool(workers) as pool:
+        for answers in ordered_map(pool, answer_chunk,
+                                   ((chunk, ) for chunk in chunks), window):
+            yield from answers
+
+
+def main(args):
+    """Usage: python batch.py [FILE] [--output FILE] [--workers N]
+    [--chunksize N]
+    Answer the JSONL tasks in FILE (default stdin) as JSONL, in order."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='batch.py')
+    parser.add_argument('file', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin)
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=64)
+    options = parser.parse_args(args)
+    for line in run_batch(options.file, options.workers, options.chunksize):
+        options.output.write(line + '\n')
+    options.output.flush()
+
+
+def test():
+    "tests."
+    from itertools import repeat
+    from boggle_game import Board, boggle_words
+    boards = ['XXXX TEST XXXX XXXX', 'PLAY THIS WORD GAME', 'AB CD']
+    tasks = [
+        json.dumps(dict(id=n, op='boggle_words', args=dict(board=board)))
+        for n, board in enumerate(boards)
+    ] + ['', '{"id": "x", "op": "anagrams", "args": {"phrase": "ENTITIES"}}',
+         '{"id": 9, "op": "nonsense"}', 'not json', '[1, 2]',
+         '{"id": 10, "op": "word_plays", "args": {"hand": "ABC"}}']
+    answers = [json.loads(line) for line in run_batch(tasks, workers=0)]
+    assert [a['id'] for a in answers] == [0, 1, 2, 'x', 9, None, None, 10]
+    assert answers[1]['result'] == sorted(
+        boggle_words(Board('PLAY THIS WORD GAME')))
+    assert 'IT IT SEEN' in answers[3]['result']
+    assert answers[4]['error'].startswith('ValueError: unknown op')
+    assert [a['error'].split(':')[0] for a in answers[5:]] == [
+        'JSONDecodeError', 'ValueError', 'TypeError']
+    assert list(run_batch(tasks, workers=2, chunksize=2)) == list(
+        run_batch(tasks, workers=0))
+    # Endless input: answers still come, as the tasks are read lazily.
+    endless = repeat(tasks[0])
+    assert next(run_batch(endless, workers=0)) == next(
+        run_batch(endless, workers=2, chunksize=4, window=2))
+    print('tests pass')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        main(sys.argv[1:])
+    else:
+        test()
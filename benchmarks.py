@@ -0,0 +1,335 @@
+'''
+Benchmarks for the word games.
+
+python benchmarks.py runs them all and prints the results.
+
+python benchmarks.py suite [--output FILE] [--baseline FILE] runs the fixed
+suite of timings (see SUITE), writes them as JSON, and flags any that are
+slower than in the baseline by more than the threshold.
+'''
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+from anagrams import anagrams, memo_anagrams, parallel_anagrams
+from boggle_game import (Board, boggle_words, fast_boggle_words, hill_climb,
+                         solve_boards)
+from self_play import BAGS, report, simulate
+from word_game import (SCRABBLE, WWF, CompactBoard, a_board, all_plays,
+                       best_play, empty_board, find_words, find_words_batch,
+                       gaddag_row_plays, make_play, parallel_all_plays,
+                       rack_cache, row_plays, topn, word_plays)
+from workers import lexicon_pool
+
+ANAGRAM_PHRASES = ['ELECTRONIC MAIL', 'DORMITORY ROOMS', 'DESIGN OF PROGRAMS']
+
+
+def bench_parallel_anagrams(phrases=ANAGRAM_PHRASES, worker_counts=None):
+    """Time parallel_anagrams on fixed phrases for each number of workers,
+    and print the speedup over one worker."""
+    if worker_counts is None:
+        worker_counts = sorted(set([1, 2, 4, os.cpu_count() or 1]))
+    print('parallel_anagrams on %s (%d CPUs)' % (phrases, os.cpu_count()))
+    expected = [sorted(memo_anagrams(phrase)) for phrase in phrases]
+    base = None
+    for workers in worker_counts:
+        t0 = time.perf_counter()
+        for phrase, answer in zip(phrases, expected):
+            assert list(parallel_anagrams(phrase, workers=workers)) == answer
+        t = time.perf_counter() - t0
+        base = base or t
+        print('%3d workers: %7.3f sec, speedup %5.2fx' % (workers, t, base / t))
+
+
+# Letters weighted roughly as on Boggle dice.
+BOGGLE_LETTERS = ('AAAAAABBCCDDDEEEEEEEEEEFFGGHHHIIIIIIJKLLLLMMNNNNNNOOOOOOPP'
+                  'QRRRRRSSSSSSTTTTTTTTUUUVVWWXYYYZ')
+
+
+def random_boards(N, count, seed=1):
+    "A list of count random N by N boards, as text rows."
+    rng = random.Random(seed)
+    return [' '.join(''.join(rng.choice(BOGGLE_LETTERS) for _ in range(N))
+                     for _ in range(N)) for _ in range(count)]
+
+
+def bench_boggle_batch(sizes=(4, 5, 6), count=2000, worker_counts=None):
+    "Print boards/sec for solve_boards (counts only) by board size and workers."
+    if worker_counts is None:
+        worker_counts = sorted(set([0, os.cpu_count() or 1]))
+    print('solve_boards, %d boards per size (%d CPUs)' % (count,
+                                                         os.cpu_count()))
+    for N in sizes:
+        boards = random_boards(N, count)
+        for workers in worker_counts:
+            t0 = time.perf_counter()
+            for _ in solve_boards(boards, workers, counts_only=True):
+                pass
+            t = time.perf_counter() - t0
+            print('%dx%d, %2d workers: %8.0f boards/sec' % (N, N, workers,
+                                                             count / t))
+
+
+def bench_hill_climb(steps=3000, seed=1):
+    """Print mutations/sec for hill_climb (incremental rescoring) next to
+    full solves/sec of the board it finds."""
+    board = Board(random_boards(5, 1, seed)[0])
+    hill_climb(board, 1)  # build the GADDAG outside the timing
+    t0 = time.perf_counter()
+    score, best = hill_climb(board, steps, seed=seed)
+    t = time.perf_counter() - t0
+    print('hill_climb 5x5: %.0f mutations/sec, best score %d' % (steps / t,
+                                                                score))
+    t0 = time.perf_counter()
+    for _ in range(100):
+        fast_boggle_words(best)
+    print('fast_boggle_words on that board: %.0f solves/sec' %
+          (100 / (time.perf_counter() - t0)))
+
+
+TILE_BAG = BAGS['SCRABBLE']  # the 100 tiles of a Scrabble set
+
+
+def random_hands(count, seed=1):
+    "A list of count random 7-tile hands drawn from TILE_BAG."
+    rng = random.Random(seed)
+    return [''.join(rng.sample(TILE_BAG, 7)) for _ in range(count)]
+
+
+def midgame_board(bonus, moves=10, seed=1):
+    """The board after moves greedy plays (best_play each turn) on an empty
+    board with this bonus layout, drawing 7 new tiles from a shuffled bag."""
+    rng = random.Random(seed)
+    bag = list(TILE_BAG)
+    rng.shuffle(bag)
+    board = empty_board(bonus)
+    for _ in range(moves):
+        hand, bag = ''.join(bag[:7]), bag[7:]
+        plays = all_plays(hand, [row[:] for row in board], None, bonus)
+        if plays:
+            make_play(max(plays), board)
+    return board
+
+
+def bench_move_generation(hands=20, engines=(row_plays, gaddag_row_plays)):
+    """Print plays/sec for all_plays with each engine, and for a CompactBoard,
+    on a_board() and on mid-game WWF and SCRABBLE boards, checking that they
+    all agree."""
+    boards = [('a_board', list(a_board()), WWF),
+              ('WWF midgame', midgame_board(WWF), WWF),
+              ('SCRABBLE midgame', midgame_board(SCRABBLE), SCRABBLE)]
+    all_plays('A', [row[:] for row in boards[0][1]], gaddag_row_plays)
+    print('all_plays, %d random hands per board' % hands)
+    for name, board, bonus in boards:
+        expected = None
+        for engine in engines:
+            t0 = time.perf_counter()
+            results = [all_plays(hand, [row[:] for row in board], engine, bonus)
+                       for hand in random_hands(hands)]
+            t = time.perf_counter() - t0
+            assert expected is None or results == expected
+            expected = results
+            plays = sum(map(len, results))
+            print('%-16s %-16s %8.0f plays/sec (%d plays, %.3f sec)' % (
+                name, engine.__name__, plays / t, plays, t))
+        t0 = time.perf_counter()
+        results = [CompactBoard(board, bonus).all_plays(hand)
+                   for hand in random_hands(hands)]
+        t = time.perf_counter() - t0
+        assert results == expected
+        print('%-16s %-16s %8.0f plays/sec (%d plays, %.3f sec)' % (
+            name, 'CompactBoard', plays / t, plays, t))
+
+
+def bench_best_plays(hands=30, ks=(1, 10)):
+    """Print hands/sec for the k best plays on mid-game boards: sorting all
+    of CompactBoard.all_plays, against the best-first best_plays."""
+    print('best plays, %d random hands per board' % hands)
+    for name, bonus in [('WWF midgame', WWF), ('SCRABBLE midgame', SCRABBLE)]:
+        board = CompactBoard(midgame_board(bonus), bonus)
+        for k in ks:
+            for method, fn in [
+                    ('sorted all_plays',
+                     lambda hand: sorted(board.all_plays(hand))[-k:]),
+                    ('best_plays', lambda hand: board.best_plays(hand, k))]:
+                t0 = time.perf_counter()
+                for hand in random_hands(hands):
+                    fn(hand)
+                t = time.perf_counter() - t0
+                print('%-16s k=%-3d %-16s %6.1f hands/sec' % (
+                    name, k, method, hands / t))
+
+
+def bench_parallel_moves(hands=10, worker_counts=None, engine=row_plays):
+    """Print hands/sec for all_plays and for parallel_all_plays with each
+    number of workers, on a full mid-game SCRABBLE board with two blanks in
+    every rack."""
+    if worker_counts is None:
+        worker_counts = sorted(set([1, 2, os.cpu_count() or 1]))
+    board = midgame_board(SCRABBLE, moves=14)
+    racks = ['__' + hand[:5].replace('_', 'E') for hand in random_hands(hands)]
+    print('parallel_all_plays, %d racks with 2 blanks (%d CPUs)' % (
+        hands, os.cpu_count()))
+    t0 = time.perf_counter()
+    expected = [all_plays(rack, [row[:] for row in board], engine, SCRABBLE)
+                for rack in racks]
+    base = time.perf_counter() - t0
+    print('all_plays:            %6.2f hands/sec' % (hands / base))
+    for workers in worker_counts:
+        with lexicon_pool(workers) as pool:
+            parallel_all_plays('A', [row[:] for row in board], engine,
+                               SCRABBLE, pool)  # start the workers
+            t0 = time.perf_counter()
+            results = [parallel_all_plays(rack, [row[:] for row in board],
+                                          engine, SCRABBLE, pool)
+                       for rack in racks]
+            t = time.perf_counter() - t0
+        assert results == expected
+        print('%2d workers:           %6.2f hands/sec, speedup %5.2fx' % (
+            workers, hands / t, base / t))
+
+
+def bench_self_play(games=8, worker_counts=None):
+    """Print games/sec, moves/sec and move latencies for seeded self-play
+    games on each layout, with each number of workers."""
+    if worker_counts is None:
+        worker_counts = sorted(set([0, os.cpu_count() or 1]))
+    for layout in ('WWF', 'SCRABBLE'):
+        for workers in worker_counts:
+            print('self-play %s, %d workers (%d CPUs)' % (layout, workers,
+                                                         os.cpu_count()))
+            print(report(*simulate(games, layout, workers=workers)))
+
+
+# The suite: name: (setup, fn). setup() makes the fixed inputs, once; each
+# timed call is fn(inputs). The rack cache is cleared before every call, so
+# that repeats measure the search and not the cache.
+SUITE = {
+    'find_words': (
+        lambda: random_hands(300, seed=2),
+        lambda hands: [find_words(hand) for hand in hands]),
+    'find_words_batch': (
+        lambda: random_hands(2000, seed=2),
+        find_words_batch),
+    'word_plays': (
+        lambda: random_hands(20, seed=3),
+        lambda hands: [word_plays(hand, 'ETAOIN') for hand in hands]),
+    'topn': (
+        lambda: random_hands(20, seed=4),
+        lambda hands: [topn(hand, 'ETAOIN') for hand in hands]),
+    'all_plays': (
+        lambda: (midgame_board(WWF), random_hands(5, seed=5)),
+        lambda inputs: [all_plays(hand, [row[:] for row in inputs[0]], None,
+                                  WWF) for hand in inputs[1]]),
+    'best_play': (
+        lambda: (midgame_board(SCRABBLE), random_hands(10, seed=6)),
+        lambda inputs: [best_play(hand, inputs[0], None, SCRABBLE)
+                        for hand in inputs[1]]),
+    'boggle_words': (
+        lambda: [Board(text) for text in random_boards(4, 100, seed=7)],
+        lambda boards: [boggle_words(board) for board in boards]),
+    'anagrams': (
+        lambda: ['ENTITIES', 'DORMITORY'],
+        lambda phrases: [anagrams(phrase) for phrase in phrases]),
+    'memo_anagrams': (
+        lambda: ANAGRAM_PHRASES[:2],
+        lambda phrases: [memo_anagrams(phrase) for phrase in phrases]),
+}
+
+
+def measure(fn, inputs, warmup=1, repeats=5):
+    """Call fn(inputs) warmup times, then time repeats more calls with
+    perf_counter. Return the min, median and mean seconds per call."""
+    times = []
+    for n in range(warmup + repeats):
+        rack_cache.clear()
+        t0 = time.perf_counter()
+        fn(inputs)
+        t = time.perf_counter() - t0
+        if n >= warmup:
+            times.append(t)
+    times.sort()
+    return dict(min=times[0], median=times[len(times) // 2],
+                mean=sum(times) / len(times))
+
+
+def run_suite(names=None, warmup=1, repeats=5):
+    """Run the named benchmarks of SUITE (default: all of them). Return the
+    results, ready to save as JSON: where and how they were run, and the
+    timings of each benchmark."""
+    timings = {}
+    for name in names or SUITE:
+        setup, fn = SUITE[name]
+        timings[name] = measure(fn, setup(), warmup, repeats)
+    return dict(python=platform.python_version(), cpus=os.cpu_count(),
+                warmup=warmup, repeats=repeats, benchmarks=timings)
+
+
+def regressions(results, baseline, threshold=0.10):
+    """The [(name, baseline seconds, seconds)] of the benchmarks whose median
+    time is more than threshold (a fraction) above the baseline's."""
+    base = baseline['benchmarks']
+    return [(name, base[name]['median'], timing['median'])
+            for name, timing in results['benchmarks'].items()
+            if name in base and
+            timing['median'] > base[name]['median'] * (1 + threshold)]
+
+
+def main(args):
+    """Usage: python benchmarks.py suite [NAME ...] [--warmup N] [--repeats N]
+    [--output FILE] [--baseline FILE] [--threshold F]
+    Print the median time of each benchmark in the suite, and write all the
+    timings as JSON to FILE ('-' for stdout). With a baseline (the output of
+    an earlier run), also print each change, and exit with status 1 if any
+    benchmark is more than F (default 0.10) slower."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='benchmarks.py suite')
+    parser.add_argument('names', nargs='*', metavar='NAME')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline', type=argparse.FileType('r'))
+    parser.add_argument('--threshold', type=float, default=0.10)
+    options = parser.parse_args(args)
+    unknown = set(options.names) - set(SUITE)
+    if unknown:
+        parser.error('unknown benchmarks %s; choose from %s' % (
+            ', '.join(sorted(unknown)), ', '.join(SUITE)))
+    results = run_suite(options.names, options.warmup, options.repeats)
+    baseline = json.load(options.baseline) if options.baseline else None
+    for name, timing in results['benchmarks'].items():
+        line = '%-16s %9.4f sec' % (name, timing['median'])
+        if baseline and name in baseline['benchmarks']:
+            base = baseline['benchmarks'][name]['median']
+            line += '  (baseline %.4f, %+.1f%%)' % (
+                base, 100 * (timing['median'] / base - 1))
+        print(line, file=sys.stderr if options.output == '-' else sys.stdout)
+    if options.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    slower = []
+    if baseline:
+        slower = regressions(results, baseline, options.threshold)
+    for name, base, now in slower:
+        print('REGRESSION %s: %.4f -> %.4f sec' % (name, base, now),
+              file=sys.stderr)
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['suite']:
+        sys.exit(main(sys.argv[2:]))
+    else:
+        bench_parallel_anagrams()
+        bench_boggle_batch()
+        bench_hill_climb()
+        bench_move_generation()
+        bench_best_plays()
+        bench_parallel_moves()
+        bench_self_play()
@@ -9,28 +9,333 @@ Word game boggle.
 # that takes a board as input and returns a set of words that
 # can be made from the board according to the rules of Boggle.
 
+import random
+import sys
+from collections import Counter, deque
+from functools import lru_cache
+from itertools import islice
 
+from instrument import counted, timed
+from lexicon import SEPARATOR, current_lexicon
+from workers import lexicon_pool, ordered_map
+
+
+@timed()
 def boggle_words(board, minlength=3):
     "Find all the words on this Boggle board; return as a set of words."
+    WORDS = counted(current_lexicon())
 
-    def find_boggle(pre, path):
-        if pre in WORDS and len(pre) >= minlength:
+    def find_boggle(pre, path, node):
+        if WORDS.is_word(node) and len(pre) >= minlength:
             results.add(pre)
-        if pre in PREFIXES:
-            for n in neighbors(path[-1], N):
-                L = board[n]
-                if L != BORDER and n not in path:
-                    find_boggle(pre + L, path + [n])
+        for n in neighbors(path[-1], N):
+            L = board[n]
+            if L != BORDER and n not in path:
+                child = WORDS.child(node, L)
+                if child is not None:
+                    find_boggle(pre + L, path + [n], child)
 
     results = set()
     N = size(board)
     for i, L in enumerate(board):
         if L != BORDER:
-            find_boggle(L, [i])
+            node = WORDS.child(WORDS.root, L)
+            if node is not None:
+                find_boggle(L, [i], node)
+
+    return results
+
+
+@timed()
+def fast_boggle_words(board, minlength=3):
+    """The same set as boggle_words(board, minlength). Each square's
+    neighbors come from a table built once per board layout, the squares on
+    the current path are bits in an int, and the word is built only when
+    the lexicon says one ends here."""
+    WORDS = counted(current_lexicon())
+    table = neighbor_table(size(board), borders(board))
+    results = set()
+    letters = []
 
+    def find_boggle(i, node, visited):
+        if WORDS.is_word(node) and len(letters) >= minlength:
+            results.add(''.join(letters))
+        for n in table[i]:
+            if not visited >> n & 1:
+                child = WORDS.child(node, board[n])
+                if child is not None:
+                    letters.append(board[n])
+                    find_boggle(n, child, visited | 1 << n)
+                    letters.pop()
+
+    for i, L in enumerate(board):
+        if L != BORDER:
+            node = WORDS.child(WORDS.root, L)
+            if node is not None:
+                letters.append(L)
+                find_boggle(i, node, 1 << i)
+                letters.pop()
     return results
 
 
+def borders(board):
+    "The tuple of positions of border squares on the board."
+    return tuple(i for i, L in enumerate(board) if L == BORDER)
+
+
+@lru_cache(maxsize=64)
+def neighbor_table(N, borders):
+    """For each square of an N by N board with border squares at positions
+    borders, the tuple of its neighbors that are not border squares."""
+    borders = set(borders)
+    return tuple(() if i in borders else tuple(
+        n for n in neighbors(i, N) if n not in borders) for i in range(N * N))
+
+
+class IncrementalBoggle(object):
+    """A Boggle board whose words and score are kept up to date as single
+    squares change. Every path that spells a word is recorded under each of
+    its squares. Changing a square drops the paths recorded under it and
+    finds the new paths through it with the lexicon's GADDAG, walking out
+    from that square (back to the start of the word, then on to its end),
+    so the rest of the board is not searched again. Only the last
+    undo_depth changes (default all since the last commit) can be undone."""
+
+    def __init__(self, board, minlength=3, undo_depth=None):
+        self.squares = list(board)
+        self.minlength = minlength
+        self.lexicon = current_lexicon()
+        self.table = neighbor_table(size(board), borders(board))
+        self.paths_at = [set() for _ in board]  # square: paths through it
+        self.paths = Counter()  # word: number of paths that spell it
+        self.words = set()
+        self.score = 0
+        # (square, old letter, paths dropped, paths found), latest last
+        self.changes = deque(maxlen=undo_depth)
+        for path in self.all_paths():
+            self.add_path(path)
+
+    @property
+    def board(self):
+        return ''.join(self.squares)
+
+    def set_square(self, i, L):
+        "Put letter L on square i, updating words and score."
+        if self.squares[i] == BORDER:
+            raise ValueError('square %d is a border' % i)
+        dropped = list(self.paths_at[i])
+        for path in dropped:
+            self.remove_path(path)
+        old, self.squares[i] = self.squares[i], L
+        found = self.paths_through(i)
+        for path in found:
+            self.add_path(path)
+        self.changes.append((i, old, dropped, found))
+
+    def undo(self):
+        "Take back the last set_square, without searching."
+        i, old, dropped, found = self.changes.pop()
+        for path in found:
+            self.remove_path(path)
+        self.squares[i] = old
+        for path in dropped:
+            self.add_path(path)
+
+    def commit(self):
+        "Keep the changes made so far: forget them, so they cannot be undone."
+        self.changes.clear()
+
+    def add_path(self, path):
+        "Record path, a (word, squares) pair."
+        word, squares = path
+        for n in squares:
+            self.paths_at[n].add(path)
+        self.paths[word] += 1
+        if self.paths[word] == 1:
+            self.words.add(word)
+            self.score += boggle_score([word])
+
+    def remove_path(self, path):
+        word, squares = path
+        for n in squares:
+            self.paths_at[n].discard(path)
+        self.paths[word] -= 1
+        if not self.paths[word]:
+            del self.paths[word]
+            self.words.remove(word)
+            self.score -= boggle_score([word])
+
+    def all_paths(self):
+        """The list of every path that spells a word, as (word, squares)
+        pairs where squares is a tuple of positions."""
+        WORDS, squares, table = self.lexicon, self.squares, self.table
+        results, path = [], []
+
+        def find(i, node, visited):
+            if WORDS.is_word(node) and len(path) >= self.minlength:
+                word = ''.join(squares[n] for n in path)
+                results.append((word, tuple(path)))
+            for n in table[i]:
+                if not visited >> n & 1:
+                    child = WORDS.child(node, squares[n])
+                    if child is not None:
+                        path.append(n)
+                        find(n, child, visited | 1 << n)
+                        path.pop()
+
+        for i, L in enumerate(squares):
+            if L != BORDER:
+                node = WORDS.child(WORDS.root, L)
+                if node is not None:
+                    path.append(i)
+                    find(i, node, 1 << i)
+                    path.pop()
+        return results
+
+    def paths_through(self, i):
+        """The (word, squares) pairs for every path that spells a word and goes
+        through square i: walk the GADDAG backwards from i to the first
+        square, then across the separator and forwards from i to the last."""
+        G, squares, table = self.lexicon.gaddag(), self.squares, self.table
+        results, back, ahead = [], [i], []
+
+        def backwards(first, node, visited):
+            across = G.child(node, SEPARATOR)
+            if across is not None:
+                forwards(i, across, visited)
+            for n in table[first]:
+                if not visited >> n & 1:
+                    child = G.child(node, squares[n])
+                    if child is not None:
+                        back.append(n)
+                        backwards(n, child, visited | 1 << n)
+                        back.pop()
+
+        def forwards(last, node, visited):
+            if G.is_word(node) and len(back) + len(ahead) >= self.minlength:
+                path = back[::-1] + ahead
+                word = ''.join(squares[n] for n in path)
+                results.append((word, tuple(path)))
+            for n in table[last]:
+                if not visited >> n & 1:
+                    child = G.child(node, squares[n])
+                    if child is not None:
+                        ahead.append(n)
+                        forwards(n, child, visited | 1 << n)
+                        ahead.pop()
+
+        node = G.child(G.root, squares[i])
+        if node is not None:
+            backwards(i, node, 1 << i)
+        return results
+
+
+def hill_climb(board, steps=1000, letters='ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+               seed=None, minlength=3):
+    """Search for a high-scoring board: change one random square at a time
+    to a random letter, keeping the change unless the score drops.
+    Return (best score, best board)."""
+    rng = random.Random(seed)
+    game = IncrementalBoggle(board, minlength)
+    squares = [i for i, L in enumerate(board) if L != BORDER]
+    best = (game.score, game.board)
+    for _ in range(steps):
+        score = game.score
+        game.set_square(rng.choice(squares), rng.choice(letters))
+        if game.score < score:
+            game.undo()
+        else:
+            game.commit()
+            if game.score > best[0]:
+                best = (game.score, game.board)
+    return best
+
+
+SCORES = {3: 1, 4: 1, 5: 2, 6: 3, 7: 5}  # and 11 for 8 letters or more
+
+
+def boggle_score(words):
+    "The total score of a set of Boggle words, by the usual table."
+    return sum(SCORES.get(len(w), 11 if len(w) > 7 else 0) for w in words)
+
+
+def as_board(text):
+    "A board made by Board(), or text rows to make one from."
+    return text if BORDER in text else Board(text)
+
+
+def solve_boards(boards, workers=None, counts_only=False, chunksize=64):
+    """Generate the result for each board (a Board() string or text rows)
+    in order: its set of words, or if counts_only a (count, score) pair.
+    With workers, boards are solved in chunks by a process pool, keeping
+    only a few chunks in flight; workers=0 solves in this process."""
+    boards = (as_board(text) for text in boards)
+    if workers == 0:
+        for board in boards:
+            yield solve_board(board, counts_only)
+        return
+    chunks = iter(lambda: list(islice(boards, chunksize)), [])
+    tasks = ((chunk, counts_only) for chunk in chunks)
+    with lexicon_pool(workers) as pool:
+        for results in ordered_map(pool, solve_chunk, tasks):
+            yield from results
+
+
+def solve_board(board, counts_only=False):
+    "The words on board, or their (count, score)."
+    words = fast_boggle_words(board)
+    return (len(words), boggle_score(words)) if counts_only else words
+
+
+def solve_chunk(boards, counts_only):
+    "The solve_board results for a list of boards (a task for a worker)."
+    return [solve_board(board, counts_only) for board in boards]
+
+
+def test_incremental():
+    "Changing squares one at a time gives the same words as solving afresh."
+    rng = random.Random(42)
+    game = IncrementalBoggle(Board('TPLER ORAIS METND DASEU NOWRB'))
+    assert len(game.words) == 317
+    squares = [i for i, L in enumerate(game.board) if L != BORDER]
+    for _ in range(40):
+        game.set_square(rng.choice(squares), rng.choice('AEIOURSTLNDP'))
+        words = boggle_words(game.board)
+        assert game.words == words and game.score == boggle_score(words)
+    for _ in range(20):
+        game.undo()
+        assert game.words == boggle_words(game.board)
+    game.commit()
+    assert not game.changes
+    game = IncrementalBoggle(Board('ABCD EFGH IJKL MNOP'), undo_depth=2)
+    i = game.board.index('F')
+    for L in 'STER':
+        game.set_square(i, L)
+    assert len(game.changes) == 2
+    game.undo()
+    assert game.board[i] == 'E' and game.words == boggle_words(game.board)
+    score, board = hill_climb(Board('ABCD EFGH IJKL MNOP'), 200, seed=1)
+    assert score == boggle_score(boggle_words(board)) > 0
+
+
+def main(args):
+    """Usage: python boggle_game.py solve [FILE] [--workers N] [--counts]
+    Solve one board per line of FILE (default stdin): text rows like
+    'TPLER ORAIS METND DASEU NOWRB', or a Board() string. Print each board's
+    sorted words, or with --counts its word count and score."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='boggle_game.py solve')
+    parser.add_argument('file', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--counts', action='store_true')
+    options = parser.parse_args(args)
+    lines = (line.strip() for line in options.file)
+    boards = (line.upper() for line in lines if line)
+    for result in solve_boards(boards, options.workers, options.counts):
+        print('%d %d' % result if options.counts else ' '.join(sorted(result)))
+
+
 def test():
     b = Board('XXXX TEST XXXX XXXX')
     assert b == '|||||||XXXX||TEST||XXXX||XXXX|||||||'
@@ -57,6 +362,22 @@ def test():
         'HIS', 'GAR', 'GAM', 'HID', 'HOG', 'PLAY', 'GOA', 'HOW', 'HOT', 'WARM',
         'GOT', 'IRE', 'GOR', 'ARS', 'ARM', 'ARE', 'TOWARD', 'THROW'
     ])
+    for text in ['XXXX TEST XXXX XXXX', 'TPLER ORAIS METND DASEU NOWRB',
+                 'PLAY THIS WORD GAME', 'A', 'AB CD']:
+        b = Board(text)
+        assert fast_boggle_words(b) == boggle_words(b)
+        assert fast_boggle_words(b, 2) == boggle_words(b, 2)
+    table = neighbor_table(6, borders(Board('XXXX TEST XXXX XXXX')))
+    assert table[7] == (8, 13, 14) and table[20] == neighbors(20, 6)
+    assert table[0] == ()
+    test_incremental()
+    assert boggle_score(['CAT', 'CATS', 'TACOS', 'TOWARDS', 'DOCTORATE']) == 20
+    texts = ['XXXX TEST XXXX XXXX', Board('PLAY THIS WORD GAME')] * 3
+    expected = [boggle_words(as_board(text)) for text in texts]
+    assert list(solve_boards(texts, workers=0)) == expected
+    assert list(solve_boards(texts, workers=2, chunksize=2)) == expected
+    assert list(solve_boards(texts[:2], counts_only=True)) == [
+        (3, 3), (len(expected[1]), boggle_score(expected[1]))]
     print('tests pass')
 
 
@@ -87,26 +408,17 @@ def display(board):
     return '\n'.join(board[i:i + N] for i in range(0, N**2, N))
 
 
-# ------------
-# Helpful functions
-# 
-# You may find the following functions useful. These functions
-# are identical to those we defined in lecture. 
-
-
-def prefixes(word):
-    "A list of the initial sequences of a word, not including the complete word."
-    return [word[:i] for i in range(len(word))]
-
-
-def readwordlist(filename):
-    "Return a pair of sets: all the words in a file, and all the prefixes. (Uppercased.)"
-    wordset = set(open(filename).read().upper().split())
-    prefixset = set(p for word in wordset for p in prefixes(word))
-    return wordset, prefixset
-
+def __getattr__(name):
+    "WORDS and PREFIXES are the current lexicon, loaded on first use."
+    if name == 'WORDS':
+        return current_lexicon()
+    if name == 'PREFIXES':
+        return current_lexicon().prefixes
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
-WORDS, PREFIXES = readwordlist('words4k.txt')
 
 if __name__ == '__main__':
-    test()
+    if sys.argv[1:2] == ['solve']:
+        main(sys.argv[2:])
+    else:
+        test()
@@ -0,0 +1,200 @@
+'''
+Instrumentation for the searches.
+
+Counters and phase timers, collected only when asked for:
+
+    with collecting() as stats:
+        best_play(hand, board)
+    print(stats)
+
+The counters are nodes (the states a search reached: lexicon nodes, or
+for anagrams partial phrases), lookups (steps asked of the lexicon),
+pruned (lookups that found nothing, and anchors cut off by a bound),
+blanks (blank tiles tried as every letter) and anchors. The searches
+count through counted(lexicon), which is the lexicon itself while
+nothing is being collected (the default), so the counters cost one test
+per search, not one per step. A phase is a timed function (see timed)
+or block (see phase); phases nest, and a phase's time includes the
+phases inside it.
+'''
+import functools
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+_stats = ContextVar('stats', default=None)
+
+
+def current_stats():
+    "The Stats being collected in this context, or None."
+    return _stats.get()
+
+
+class Stats(object):
+    """Counts, and the seconds and calls of each phase. If callback is given,
+    it is called with (phase, seconds) as each phase ends."""
+
+    def __init__(self, callback=None):
+        self.counts = Counter()
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.callback = callback
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def lookup(self, child):
+        "Count a lookup in the lexicon that gave child (None if nothing)."
+        self.counts['lookups'] += 1
+        if child is None:
+            self.counts['pruned'] += 1
+
+    def record(self, phase, seconds):
+        "Add a call of phase that took seconds."
+        self.seconds[phase] += seconds
+        self.calls[phase] += 1
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    def as_dict(self):
+        return dict(counts=dict(self.counts), phases={
+            phase: dict(seconds=self.seconds[phase], calls=self.calls[phase])
+            for phase in self.calls})
+
+    def __str__(self):
+        lines = ['%-16s %10d' % item for item in sorted(self.counts.items())]
+        lines += ['%-16s %10.4f sec %8d calls' % (
+            phase, self.seconds[phase], self.calls[phase])
+                  for phase in sorted(self.calls, key=self.seconds.get,
+                                      reverse=True)]
+        return '\n'.join(lines)
+
+
+class CountedLexicon(object):
+    "A lexicon (or GADDAG) whose child and children steps are counted."
+
+    def __init__(self, lexicon, stats):
+        self.lexicon, self.stats = lexicon, stats
+
+    def __getattr__(self, name):
+        return getattr(self.lexicon, name)
+
+    def child(self, node, L):
+        child = self.lexicon.child(node, L)
+        self.stats.lookup(child)
+        if child is not None:
+            self.stats.counts['nodes'] += 1
+        return child
+
+    def children(self, node):
+        "The children, as a blank expansion."
+        counts = self.stats.counts
+        counts['blanks'] += 1
+        counts['lookups'] += 1
+        for item in self.lexicon.children(node):
+            counts['nodes'] += 1
+            yield item
+
+
+def counted(lexicon):
+    "The lexicon, counting its steps if stats are being collected."
+    stats = _stats.get()
+    return lexicon if stats is None else CountedLexicon(lexicon, stats)
+
+
+@contextmanager
+def collecting(stats=None, callback=None):
+    """Collect stats for the searches made in this block (and in the threads
+    and tasks it starts with a copy of its context); yield the Stats."""
+    if stats is None:
+        stats = Stats(callback)
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+
+class Phase(object):
+    "A block timed as phase name in stats."
+
+    def __init__(self, stats, name):
+        self.stats, self.name = stats, name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.stats.record(self.name, time.perf_counter() - self.t0)
+
+
+NO_PHASE = nullcontext()
+
+
+def phase(name):
+    "A context manager that times its block as phase name, when collecting."
+    stats = _stats.get()
+    return NO_PHASE if stats is None else Phase(stats, name)
+
+
+def timed(name=None):
+    "Decorator: time each call of the function as a phase (default its name)."
+
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            stats = _stats.get()
+            if stats is None:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stats.record(label, time.perf_counter() - t0)
+
+        return wrapper
+
+    return decorator
+
+
+def test():
+    "tests."
+    from lexicon import Lexicon
+
+    @timed()
+    def square(x):
+        stats = current_stats()
+        if stats: stats.count('nodes')
+        return x * x
+
+    assert square(3) == 9 and current_stats() is None
+    ended = []
+    with collecting(callback=lambda phase, t: ended.append(phase)) as stats:
+        assert current_stats() is stats
+        with phase('squares'):
+            assert [square(x) for x in range(4)] == [0, 1, 4, 9]
+        stats.lookup(None)
+        stats.lookup(object())
+    assert current_stats() is None
+    assert stats.counts == Counter(nodes=4, lookups=2, pruned=1)
+    assert stats.calls == Counter(square=4, squares=1)
+    assert stats.seconds['squares'] >= stats.seconds['square'] > 0
+    assert ended == ['square'] * 4 + ['squares']
+    assert stats.as_dict()['phases']['square']['calls'] == 4
+    assert 'squares' in str(stats)
+    lexicon = Lexicon(['AT', 'AX'])
+    assert counted(lexicon) is lexicon
+    with collecting() as stats:
+        words = counted(lexicon)
+        node = words.child(words.root, 'A')
+        assert words.child(node, 'B') is None
+        assert [L for L, child in words.children(node)] == ['T', 'X']
+    assert stats.counts == Counter(nodes=3, lookups=3, pruned=1, blanks=1)
+    print('tests pass')
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,196 @@
+'''
+Letter-count index: which words of a lexicon can be made from a rack.
+
+The index is a (number of words, 26) matrix of letter counts, one row per
+word, and each word's set of letters as a 26-bit mask. A word fits a rack
+when, for every letter, it needs no more than the rack has, with each
+blank making up one missing letter. A batch of racks is tested against
+every word at once: first by masks (a word can only fit a rack without
+blanks if it has no letter the rack lacks), then by counts, for just the
+(rack, word) pairs that pass. So thousands of racks cost a few NumPy
+calls, not a search each.
+
+Only plain words and racks, of the letters A to Z, are indexed and
+tested; others are left to a search of the lexicon (see is_plain).
+
+NumPy is optional, and imported only when the first index is built:
+without it, index_for() is None and find_words and word_plays search the
+lexicon as before.
+'''
+import threading
+import weakref
+
+from lexicon import current_lexicon
+
+np = None  # NumPy, once load_numpy() has imported it
+numpy_missing = False  # whether load_numpy() found there is none
+PAIRS = 1 << 20  # at most this many (rack, word) pairs checked at once
+
+
+def load_numpy():
+    "Import NumPy, the first time; return whether there is a NumPy."
+    global np, numpy_missing
+    if np is None and not numpy_missing:
+        try:
+            import numpy as np
+        except ImportError:  # the searches fall back to walking the lexicon
+            numpy_missing = True
+    return np is not None
+
+
+def is_plain(letters):
+    "Are letters all A to Z (and not empty)?"
+    return letters.isascii() and letters.isalpha() and letters.isupper()
+
+
+class LetterIndex(object):
+    """The letter counts of a list of words, for fit tests against racks.
+    Words that are not plain (see is_plain) are left out."""
+
+    def __init__(self, words):
+        load_numpy()
+        self.words = np.array([w for w in words if is_plain(w)], object)
+        self.counts = rack_counts(self.words)
+        self.masks = letter_masks(self.counts)
+        self.lengths = self.counts.sum(1, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.words)
+
+    def fits(self, racks, blanks=None):
+        """A (len(racks), len(words)) boolean matrix: can racks[r] make
+        words[w]? A '_' in a rack is a blank; other non-letters are ignored.
+        With blanks, it is the number of blanks for every rack instead."""
+        result = np.zeros((len(racks), len(self.words)), bool)
+        for r, chunk in self.chunks(racks):
+            result[r:r + len(chunk)] = self.fits_chunk(chunk, blanks)
+        return result
+
+    def chunks(self, racks):
+        """Generate (start, racks[start:...]) in chunks of at most PAIRS
+        (rack, word) pairs."""
+        step = max(1, PAIRS // max(1, len(self.words)))
+        for r in range(0, len(racks), step):
+            yield r, racks[r:r + step]
+
+    def fits_chunk(self, racks, blanks):
+        have = rack_counts(racks)
+        if blanks is None:
+            spare = np.array([rack.count('_') for rack in racks], np.int32)
+        else:
+            spare = np.full(len(racks), blanks, np.int32)
+        sizes = have.sum(1, dtype=np.int32) + spare
+        lacking = ~letter_masks(have)
+        result = (self.lengths <= sizes[:, None]) & (
+            (spare[:, None] > 0) | ((self.masks & lacking[:, None]) == 0))
+        rows, cols = np.nonzero(result)
+        for p in range(0, len(rows), PAIRS):
+            r, w = rows[p:p + PAIRS], cols[p:p + PAIRS]
+            need, got = self.counts[w], have[r]
+            short = (need - np.minimum(need, got)).sum(1, dtype=np.int32)
+            result[r, w] = short <= spare[r]
+        return result
+
+    def find_words(self, rack, blanks=None):
+        "The set of words that rack can make (see fits)."
+        return self.find_words_batch([rack], blanks)[0]
+
+    def find_words_batch(self, racks, blanks=None):
+        "For each rack in racks, the set of words it can make (see fits)."
+        words = self.words
+        return [set(words[row].tolist())
+                for _, chunk in self.chunks(racks)
+                for row in self.fits_chunk(chunk, blanks)]
+
+    def word_plays(self, hand, board_letters):
+        """The words that use one of board_letters, and otherwise only
+        letters from hand: the same set as word_game.word_plays, for a
+        hand without blanks."""
+        letters = sorted(set(board_letters))
+        if not letters:
+            return set()
+        fit = self.fits([hand + L for L in letters], 0)
+        uses = self.counts[:, [ord(L) - ord('A') for L in letters]].T > 0
+        return set(self.words[(fit & uses).any(0)].tolist())
+
+
+def rack_counts(racks):
+    "A (len(racks), 26) matrix of the letter counts of each rack."
+    codes = np.frombuffer(''.join(racks).encode('latin-1', 'replace'),
+                          np.uint8).astype(np.intp) - ord('A')
+    rows = np.repeat(np.arange(len(racks)), [len(rack) for rack in racks])
+    letters = (codes >= 0) & (codes < 26)
+    counts = np.zeros((len(racks), 26), np.int32)
+    np.add.at(counts, (rows[letters], codes[letters]), 1)
+    return np.minimum(counts, 255).astype(np.uint8)
+
+
+def letter_masks(counts):
+    "The set of letters in each row of a counts matrix, as a 26-bit mask."
+    return ((counts > 0) * (1 << np.arange(26, dtype=np.int32))).sum(
+        1, dtype=np.int32)
+
+
+_indexes = weakref.WeakKeyDictionary()  # lexicon: LetterIndex
+_lock = threading.Lock()
+
+
+def index_for(lexicon=None):
+    """The LetterIndex of lexicon (default: the current one), built the first
+    time it is asked for; or None without NumPy."""
+    if not load_numpy():
+        return None
+    if lexicon is None:
+        lexicon = current_lexicon()
+    with _lock:
+        if lexicon not in _indexes:
+            _indexes[lexicon] = LetterIndex(lexicon)
+        return _indexes[lexicon]
+
+
+def test():
+    "tests."
+    global PAIRS
+    if index_for() is None:
+        print('tests skipped: no NumPy')
+        return
+    index = LetterIndex(['AT', 'TA', 'CAT', 'TACT', 'ACT', 'A'])
+    assert index.find_words('TAC') == {'AT', 'TA', 'CAT', 'ACT', 'A'}
+    assert index.find_words('TT_') == {'AT', 'TA', 'A'}
+    assert index.find_words('TT_C') == {'AT', 'TA', 'CAT', 'ACT', 'TACT', 'A'}
+    assert index.find_words('TC', blanks=1) == index.find_words('TC_')
+    assert index.find_words('') == set()
+    racks = ['A', 'XYZ', 'CTTA']
+    assert index.find_words_batch(racks) == [
+        {'A'}, set(), {'AT', 'TA', 'CAT', 'ACT', 'TACT', 'A'}]
+    assert index.word_plays('AT', 'C') == {'CAT', 'ACT'}
+    assert index.word_plays('A', 'TC') == {'AT', 'TA'}
+    fits, saved, PAIRS = index.fits(racks), PAIRS, 6  # a rack at a time
+    try:
+        assert list(index.chunks(racks)) == [(0, ['A']), (1, ['XYZ']),
+                                             (2, ['CTTA'])]
+        assert (index.fits(racks) == fits).all()
+        assert index.find_words_batch(racks)[2] == index.find_words('CTTA')
+    finally:
+        PAIRS = saved
+    assert LetterIndex(["DON'T", 'A\xd1O', 'NOD']).find_words(
+        'DONTAOX') == {'NOD'}
+    assert not is_plain("DON'T") and not is_plain('A\xd1O')
+    assert not is_plain('') and not is_plain('ab') and is_plain('NOD')
+    lexicon = current_lexicon()
+    assert index_for(lexicon) is index_for() and len(index_for()) == len(
+        lexicon)
+    from lexicon import Lexicon, using_lexicon
+    from word_game import find_words_uncached, lexicon_words
+    with using_lexicon(Lexicon(["DON'T", 'A\xd1O', 'NOD'])):
+        assert find_words_uncached('DONTAOX') == find_words_uncached(
+            'DONTAO') == {'NOD'}
+    racks = ['ABECEDR', 'AEINRST', 'DRAMITC', 'SHROUDT', 'TOXENSI', 'Q',
+             'ETA', 'ADEINRST', 'QUIZ_ED']
+    assert index_for().find_words_batch(racks, blanks=0) == [
+        lexicon_words(rack) for rack in racks]
+    print('tests pass')
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,494 @@
+'''
+Lexicon: a set of words stored as a minimized DAWG (directed acyclic word graph).
+
+Searches start at lexicon.root and walk one letter at a time with
+lexicon.child(node, L), so they never build and hash prefix strings.
+Common suffixes are shared between words, so the graph is much smaller
+than a set of all the prefixes.
+
+A lexicon can be compiled to a packed binary file (python lexicon.py
+words.txt words.dawg, which also writes its GADDAG as words.gaddag);
+PackedLexicon maps that file read-only, so loading it is O(1) and
+processes that load the same file share its pages.
+
+Lexicons are loaded on first use and cached per path: get_lexicon(filename)
+loads one, current_lexicon() is the one searches use (the file named by
+$WORD_GAMES_LEXICON, else words4k.txt beside this module), and
+`with using_lexicon(filename_or_lexicon):` swaps it for one request.
+'''
+import contextlib
+import contextvars
+import mmap
+import os
+import struct
+import sys
+import threading
+
+
+class Node(object):
+    "A DAWG node: edges from letters to nodes, and whether a word ends here."
+    __slots__ = ('edges', 'final')
+
+    def __init__(self):
+        self.edges = {}
+        self.final = False
+
+    def key(self):
+        "Nodes with equal keys accept the same suffixes, so can be merged."
+        return (self.final,
+                tuple((L, id(n)) for (L, n) in sorted(self.edges.items())))
+
+
+def build_dawg(words):
+    """Build a minimized DAWG of words and return its root. Words are added
+    in sorted order; once a branch is finished, its nodes are merged with
+    equivalent nodes already in the register."""
+    root = Node()
+    register = {}
+    unchecked = []  # (parent, letter, child) edges along the previous word
+    previous = ''
+    for word in sorted(set(words)):
+        common = 0
+        for a, b in zip(word, previous):
+            if a != b: break
+            common += 1
+        minimize(unchecked, register, common)
+        node = unchecked[-1][2] if unchecked else root
+        for L in word[common:]:
+            child = Node()
+            node.edges[L] = child
+            unchecked.append((node, L, child))
+            node = child
+        node.final = True
+        previous = word
+    minimize(unchecked, register, 0)
+    return root
+
+
+def minimize(unchecked, register, down_to):
+    "Merge the unchecked nodes below depth down_to with registered equivalents."
+    while len(unchecked) > down_to:
+        parent, L, child = unchecked.pop()
+        key = child.key()
+        if key in register:
+            parent.edges[L] = register[key]
+        else:
+            register[key] = child
+
+
+class Lexicon(object):
+    """A set of uppercase words that can also be walked letter by letter.
+    Subclasses may use other kinds of node; they need only provide root,
+    child, children, has_children and is_word."""
+
+    def __init__(self, words=()):
+        self.root = build_dawg(words)
+        self.filename = None
+        self.heights = {}
+
+    @classmethod
+    def from_file(cls, filename):
+        "Read the whitespace-separated words in a file (uppercased)."
+        with open(filename) as file:
+            lexicon = cls(file.read().upper().split())
+        lexicon.filename = filename
+        return lexicon
+
+    def __reduce__(self):
+        """Pickle by filename when there is one, so another process loads (or
+        maps) the file once through its own registry; else by word list."""
+        if self.filename is not None:
+            return (get_lexicon, (self.filename, ))
+        return (Lexicon, (list(self), ))
+
+    def child(self, node, L):
+        "The node reached from node along the edge labelled L, or None."
+        return node.edges.get(L)
+
+    def children(self, node):
+        "The (letter, node) edges out of node."
+        return node.edges.items()
+
+    def is_word(self, node):
+        "Does a word end at this node?"
+        return node.final
+
+    def has_children(self, node):
+        "Does any edge leave this node (so it is a proper prefix of a word)?"
+        return bool(node.edges)
+
+    def walk(self, node, s):
+        "The node reached by spelling s from node, or None."
+        for L in s:
+            node = self.child(node, L)
+            if node is None:
+                return None
+        return node
+
+    def node(self, s):
+        "The node reached by spelling s from the root, or None."
+        return self.walk(self.root, s)
+
+    def has_prefix(self, s):
+        "Is s a proper prefix of some word in the lexicon?"
+        node = self.node(s)
+        return node is not None and self.has_children(node)
+
+    def __contains__(self, word):
+        node = self.node(word)
+        return node is not None and self.is_word(node)
+
+    def __iter__(self):
+        "Generate the words in sorted order."
+        stack = [('', self.root)]
+        while stack:
+            pre, node = stack.pop()
+            if self.is_word(node):
+                yield pre
+            for L, child in sorted(self.children(node), reverse=True):
+                stack.append((pre + L, child))
+
+    def __len__(self):
+        return self.count_paths(self.is_word)
+
+    @property
+    def prefixes(self):
+        "A read-only set-like view of all the proper prefixes of the words."
+        return Prefixes(self)
+
+    def height(self, node):
+        "The length of the longest string that leads from node to a word end."
+        if node not in self.heights:
+            self.heights[node] = max(
+                (1 + self.height(child) for _, child in self.children(node)),
+                default=0)
+        return self.heights[node]
+
+    def gaddag(self):
+        """A lexicon of the GADDAG strings of these words (see gaddag_strings),
+        built the first time it is asked for."""
+        if getattr(self, '_gaddag', None) is None:
+            self._gaddag = Lexicon(gaddag_strings(self))
+        return self._gaddag
+
+    def nodes(self):
+        "The set of distinct nodes reachable from the root."
+        seen, stack = set(), [self.root]
+        while stack:
+            node = stack.pop()
+            if node not in seen:
+                seen.add(node)
+                stack.extend(child for _, child in self.children(node))
+        return seen
+
+    def count_paths(self, counted):
+        """The number of distinct strings spelled from the root to a node
+        for which counted(node) is true."""
+        memo = {}
+
+        def count(node):
+            if node not in memo:
+                memo[node] = (1 if counted(node) else 0) + sum(
+                    count(child) for _, child in self.children(node))
+            return memo[node]
+
+        return count(self.root)
+
+
+SEPARATOR = '>'
+
+
+def gaddag_strings(words):
+    """For each word and each way to split it into a non-empty front and a
+    back, the string reversed(front) + SEPARATOR + back. Walking these from
+    any letter of a word, first backwards to the word's start and then
+    forwards, spells the word once per position it is started from."""
+    for word in words:
+        for k in range(1, len(word) + 1):
+            yield word[k - 1::-1] + SEPARATOR + word[k:]
+
+
+class Prefixes(object):
+    "The proper prefixes of a lexicon's words, as a set-like view."
+
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+
+    def __contains__(self, s):
+        return self.lexicon.has_prefix(s)
+
+    def __len__(self):
+        return self.lexicon.count_paths(self.lexicon.has_children)
+
+
+MAGIC = b'DAWG'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')  # magic, version, node count, edge count
+
+
+def compile_lexicon(lexicon, filename):
+    """Write lexicon to filename as packed arrays. Node n's edges are
+    first[n]:first[n+1] in the parallel letters and targets arrays, sorted
+    by letter; the root is node 0. Letters are one byte each, so they must
+    be ASCII; others raise ValueError."""
+    numbers = {lexicon.root: 0}
+    order = [lexicon.root]
+    for node in order:  # order grows as new nodes are numbered
+        for _, child in sorted(lexicon.children(node)):
+            if child not in numbers:
+                numbers[child] = len(order)
+                order.append(child)
+    first, letters, targets, finals = [0], bytearray(), [], bytearray()
+    for node in order:
+        for L, child in sorted(lexicon.children(node)):
+            if ord(L) > 127:
+                raise ValueError('cannot compile %r: packed lexicons hold '
+                                 'only ASCII letters' % L)
+            letters.append(ord(L))
+            targets.append(numbers[child])
+        first.append(len(targets))
+        finals.append(lexicon.is_word(node))
+    with open(filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(order), len(targets)))
+        file.write(struct.pack('<%dI' % len(first), *first))
+        file.write(struct.pack('<%dI' % len(targets), *targets))
+        file.write(letters)
+        file.write(finals)
+
+
+def gaddag_filename(filename):
+    "The name of the compiled GADDAG that goes with a compiled lexicon file."
+    return os.path.splitext(filename)[0] + '.gaddag'
+
+
+def compile_lexicon_and_gaddag(lexicon, filename):
+    """Compile lexicon to filename, and its GADDAG beside it (see
+    gaddag_filename), where PackedLexicon.gaddag() will find it."""
+    compile_lexicon(lexicon, filename)
+    compile_lexicon(lexicon.gaddag(), gaddag_filename(filename))
+
+
+BYTES = {chr(i): bytes([i]) for i in range(128)}
+
+
+class PackedLexicon(Lexicon):
+    """A lexicon read from a file written by compile_lexicon. The file is
+    memory-mapped, never copied; nodes are integers."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, nodes, edges = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d lexicon file' %
+                             (filename, VERSION))
+        if sys.byteorder != 'little':
+            raise ValueError('packed lexicons need a little-endian machine')
+        view = memoryview(self._map)
+        offset = HEADER.size
+        self._first = view[offset:offset + 4 * (nodes + 1)].cast('I')
+        offset += 4 * (nodes + 1)
+        self._targets = view[offset:offset + 4 * edges].cast('I')
+        offset += 4 * edges
+        self._letters_at = offset
+        self._letters = view[offset:offset + edges]
+        self._finals = view[offset + edges:offset + edges + nodes]
+        self.root = 0
+        self.heights = {}
+
+    def child(self, node, L):
+        code = BYTES.get(L)
+        if code is None:
+            return None
+        base = self._letters_at
+        k = self._map.find(code, base + self._first[node],
+                           base + self._first[node + 1])
+        return None if k < 0 else self._targets[k - base]
+
+    def children(self, node):
+        a, b = self._first[node], self._first[node + 1]
+        return zip(self._letters[a:b].tobytes().decode('ascii'),
+                   self._targets[a:b])
+
+    def has_children(self, node):
+        return self._first[node + 1] > self._first[node]
+
+    def is_word(self, node):
+        return self._finals[node] == 1
+
+    def gaddag(self):
+        """The GADDAG: mapped from the compiled file beside this one, if there
+        is one at least as new (see compile_lexicon_and_gaddag); else built."""
+        if getattr(self, '_gaddag', None) is None:
+            filename = gaddag_filename(self.filename)
+            if filename != self.filename and os.path.exists(filename) and (
+                    os.path.getmtime(filename) >=
+                    os.path.getmtime(self.filename)):
+                self._gaddag = PackedLexicon(filename)
+        return Lexicon.gaddag(self)
+
+
+def load_lexicon(filename):
+    """Load a lexicon from a word list or a compiled lexicon file. For a word
+    list, a compiled file beside it (same name, .dawg extension) is used
+    instead if it is at least as new."""
+    with open(filename, 'rb') as file:
+        if file.read(len(MAGIC)) == MAGIC:
+            return PackedLexicon(filename)
+    compiled = os.path.splitext(filename)[0] + '.dawg'
+    if os.path.exists(compiled) and (
+            os.path.getmtime(compiled) >= os.path.getmtime(filename)):
+        return PackedLexicon(compiled)
+    return Lexicon.from_file(filename)
+
+
+DEFAULT_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'words4k.txt')
+ENVIRONMENT_VARIABLE = 'WORD_GAMES_LEXICON'
+
+loaded = {}  # filename (real path, and as given if absolute): lexicon
+loading = threading.Lock()
+in_use = contextvars.ContextVar('lexicon', default=None)
+
+
+def get_lexicon(filename=None):
+    """The lexicon in filename (default: $WORD_GAMES_LEXICON, else
+    DEFAULT_FILE), loaded the first time it is asked for."""
+    if filename is None:
+        filename = os.environ.get(ENVIRONMENT_VARIABLE) or DEFAULT_FILE
+    if filename in loaded:  # only absolute names are kept as given
+        return loaded[filename]
+    key = os.path.realpath(filename)
+    with loading:
+        if key not in loaded:
+            lexicon = loaded[key] = load_lexicon(key)
+            # It may have come from a compiled file; that name finds it too.
+            loaded.setdefault(os.path.realpath(lexicon.filename), lexicon)
+        if os.path.isabs(filename):
+            loaded[filename] = loaded[key]
+        return loaded[key]
+
+
+def current_lexicon():
+    "The lexicon that searches use in this context."
+    lexicon = in_use.get()
+    return lexicon if lexicon is not None else get_lexicon()
+
+
+def use_lexicon(lexicon):
+    """Make lexicon (a Lexicon or a filename) the current lexicon from now
+    on in this context; e.g. as a worker process initializer."""
+    if not isinstance(lexicon, Lexicon):
+        lexicon = get_lexicon(lexicon)
+    in_use.set(lexicon)
+
+
+@contextlib.contextmanager
+def using_lexicon(lexicon):
+    """Make lexicon (a Lexicon, or a filename for get_lexicon) the current
+    lexicon within the with block, in this thread or task only."""
+    if not isinstance(lexicon, Lexicon):
+        lexicon = get_lexicon(lexicon)
+    token = in_use.set(lexicon)
+    try:
+        yield lexicon
+    finally:
+        in_use.reset(token)
+
+
+def test():
+    "tests."
+    import pickle
+    lex = Lexicon(['CAT', 'CATS', 'DOG', 'DOGS', 'DO', 'CAT'])
+    assert len(lex) == 5
+    assert list(lex) == ['CAT', 'CATS', 'DO', 'DOG', 'DOGS']
+    assert 'DOG' in lex and 'DOGS' in lex and 'DOGSS' not in lex
+    assert 'CA' not in lex and '' not in lex
+    assert 'CA' in lex.prefixes and 'DOG' in lex.prefixes
+    assert '' in lex.prefixes and 'DOGS' not in lex.prefixes
+    assert len(lex.prefixes) == 7  # '', C, CA, CAT, D, DO, DOG
+    # CAT/DOG and CATS/DOGS share their endings.
+    assert lex.node('CAT') is lex.node('DOG')
+    assert len(lex.nodes()) == 7
+    assert lex.child(lex.node('CA'), 'X') is None
+    assert lex.height(lex.root) == 4 and lex.height(lex.node('DOGS')) == 0
+    assert list(gaddag_strings(['CAT'])) == ['C>AT', 'AC>T', 'TAC>']
+    assert 'GOD>S' in lex.gaddag() and 'OD>G' in lex.gaddag()
+    assert 'DO>G' not in lex.gaddag()
+    assert sorted(L for L, _ in lex.children(lex.root)) == ['C', 'D']
+    assert len(Lexicon()) == 0 and list(Lexicon()) == []
+    test_packed(lex)
+    with using_lexicon(lex):
+        assert current_lexicon() is lex
+    assert list(pickle.loads(pickle.dumps(lex))) == list(lex)
+    default = get_lexicon(DEFAULT_FILE)
+    assert pickle.loads(pickle.dumps(default)) is default
+    assert current_lexicon() is get_lexicon(DEFAULT_FILE)
+    assert get_lexicon(DEFAULT_FILE) is get_lexicon(DEFAULT_FILE)
+    test_relative()
+    print('tests pass')
+
+
+def test_packed(lex):
+    "A compiled lexicon answers exactly like the one it was compiled from."
+    import pickle
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'test.dawg')
+        compile_lexicon(lex, filename)
+        packed = load_lexicon(filename)
+        assert isinstance(packed, PackedLexicon)
+        assert list(packed) == list(lex) and len(packed) == len(lex)
+        assert len(packed.prefixes) == len(lex.prefixes)
+        assert len(packed.nodes()) == len(lex.nodes())
+        assert packed.height(packed.node('DO')) == 2
+        assert 'DOGS' in packed and 'DOGSS' not in packed
+        assert packed.child(packed.root, 'x') is None
+        assert packed.child(packed.root, '\u00e9') is None
+        assert list(pickle.loads(pickle.dumps(packed))) == list(lex)
+        assert not isinstance(packed.gaddag(), PackedLexicon)
+        del packed
+        filename = os.path.join(tmp, 'both.dawg')
+        compile_lexicon_and_gaddag(lex, filename)
+        assert os.path.exists(os.path.join(tmp, 'both.gaddag'))
+        packed = load_lexicon(filename)
+        gaddag = packed.gaddag()
+        assert isinstance(gaddag, PackedLexicon) and gaddag is packed.gaddag()
+        assert list(gaddag) == list(lex.gaddag())
+        assert isinstance(load_lexicon(gaddag.filename), PackedLexicon)
+        del packed, gaddag
+        try:
+            compile_lexicon(Lexicon(['NOD', 'A\u00d1O']), filename + '2')
+            raise AssertionError('expected a ValueError')
+        except ValueError as e:
+            assert 'ASCII' in str(e)
+        assert not os.path.exists(filename + '2')
+
+
+def test_relative():
+    "A relative filename names a different file after a change of directory."
+    import tempfile
+    here = os.getcwd()
+    with tempfile.TemporaryDirectory() as a, \
+            tempfile.TemporaryDirectory() as b:
+        for directory, word in [(a, 'GNU'), (b, 'EMU')]:
+            with open(os.path.join(directory, 'w.txt'), 'w') as file:
+                file.write(word + '\n')
+        try:
+            os.chdir(a)
+            first = get_lexicon('w.txt')
+            os.chdir(b)
+            second = get_lexicon('w.txt')
+        finally:
+            os.chdir(here)
+        assert 'GNU' in first and 'EMU' in second and first is not second
+        assert 'w.txt' not in loaded
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:  # python lexicon.py words.txt words.dawg
+        compile_lexicon_and_gaddag(Lexicon.from_file(sys.argv[1]),
+                                   sys.argv[2])
+    else:
+        test()
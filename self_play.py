@@ -0,0 +1,176 @@
+'''
+Self-play for the word game.
+
+Seeded games between greedy players: on each turn the player makes
+best_play with their rack, and draws back up to 7 tiles from the bag.
+The same seed always plays the same game, so simulate() is a repeatable
+load generator for the move engines: it reports games/sec, moves/sec and
+percentiles of the time taken to choose each move.
+
+python self_play.py [--games N] [--layout WWF|SCRABBLE] [--workers N]
+'''
+import random
+import sys
+import time
+
+from lexicon import current_lexicon
+from word_game import (POINTS, SCRABBLE, WWF, best_play, empty_board,
+                       gaddag_row_plays, is_letter, make_play, row_plays)
+from workers import lexicon_pool, ordered_map
+
+LAYOUTS = {'WWF': WWF, 'SCRABBLE': SCRABBLE}
+ENGINES = {'best_plays': None, 'row_plays': row_plays,
+           'gaddag_row_plays': gaddag_row_plays}
+
+# The tiles of each game's set, by layout; '_' is a blank.
+BAGS = {
+    'SCRABBLE': ('AAAAAAAAABBCCDDDDEEEEEEEEEEEEFFGGGHHIIIIIIIIIJKLLLLMMNNNNNN'
+                 'OOOOOOOOPPQRRRRRRSSSSTTTTTTUUUUVVWWXYYZ__'),
+    'WWF': ('AAAAAAAAABBCCDDDDDEEEEEEEEEEEEEFFGGGHHHHIIIIIIIIJKLLLLMMNNNNN'
+            'OOOOOOOOPPQRRRRRRSSSSSTTTTTTTUUUUVVWWXYYZ__')}
+RACK_SIZE = 7
+
+
+def play_game(layout='WWF', seed=0, players=2, engine=None):
+    """Play one game on the layout ('WWF' or 'SCRABBLE'), shuffling the bag
+    with seed. Each turn the player makes best_play(rack, board, engine), or
+    passes if there is none. The game ends when the bag is empty and a player
+    has used all their tiles, or when every player has passed twice in a
+    row; then each player loses the points left on their rack, and a player
+    who went out gains them all. Return a dict of the final 'scores', the
+    'moves' played, in order, the seconds taken to choose each one, as
+    'latencies', and the final 'board'."""
+    bonus = LAYOUTS[layout]
+    rng = random.Random(seed)
+    bag = list(BAGS[layout])
+    rng.shuffle(bag)
+    board = empty_board(bonus)
+    racks = [draw('', bag) for _ in range(players)]
+    scores = [0] * players
+    moves, latencies = [], []
+    player, passes = 0, 0
+    # Load the lexicon and build its GADDAG (once per process) untimed, so
+    # that the first move's latency is not the cost of starting up.
+    current_lexicon().gaddag()
+    while passes < 2 * players:
+        t0 = time.perf_counter()
+        play = best_play(racks[player], board, engine, bonus)
+        latencies.append(time.perf_counter() - t0)
+        if play is None:
+            passes += 1
+        else:
+            passes = 0
+            racks[player] = draw(remove_tiles(racks[player], play, board), bag)
+            make_play(play, board)
+            scores[player] += play[0]
+            moves.append(play)
+            if not racks[player]:
+                break
+        player = (player + 1) % players
+    left = [sum(POINTS[t] for t in rack) for rack in racks]
+    for p in range(players):
+        scores[p] -= left[p]
+        if not racks[p]:
+            scores[p] += sum(left)
+    return dict(scores=scores, moves=moves, latencies=latencies, board=board)
+
+
+def draw(rack, bag):
+    "Fill rack up to RACK_SIZE tiles from the end of bag (which is shuffled)."
+    while len(rack) < RACK_SIZE and bag:
+        rack += bag.pop()
+    return rack
+
+
+def remove_tiles(rack, play, board):
+    """The rack left after making play on board: the tiles it puts on empty
+    squares are taken out, a blank for each lowercase letter."""
+    (score, (i, j), (di, dj), word) = play
+    for n, L in enumerate(word):
+        if not is_letter(board[j + dj * n][i + di * n]):
+            rack = rack.replace('_' if L.islower() else L, '', 1)
+    return rack
+
+
+def simulate(games=10, layout='WWF', seed=0, workers=0, engine=None):
+    """Play games seeded seed, seed+1, ...; with workers, the games are played
+    in parallel by a pool of processes (workers=0 plays them here). Return
+    the results of play_game, in seed order, and the elapsed seconds."""
+    tasks = [(layout, seed + n, 2, engine) for n in range(games)]
+    current_lexicon().gaddag()  # as in play_game, before the clock starts
+    t0 = time.perf_counter()
+    if workers == 0:
+        results = [play_game(*task) for task in tasks]
+    else:
+        with lexicon_pool(workers) as pool:
+            results = list(ordered_map(pool, play_game, tasks))
+    return results, time.perf_counter() - t0
+
+
+def percentile(values, p):
+    "The p-th percentile (0 to 100) of a non-empty list, by nearest rank."
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def report(results, seconds):
+    "A summary of the results of simulate: throughput and move latencies."
+    moves = sum(len(r['moves']) for r in results)
+    latencies = [t * 1000 for r in results for t in r['latencies']]
+    scores = [s for r in results for s in r['scores']]
+    return ('%d games, %d moves in %.2f sec: %.2f games/sec, %.1f moves/sec\n'
+            'move latency ms: p50 %.1f, p90 %.1f, p99 %.1f, max %.1f\n'
+            'mean final score %.1f' % (
+                len(results), moves, seconds, len(results) / seconds,
+                moves / seconds, percentile(latencies, 50),
+                percentile(latencies, 90), percentile(latencies, 99),
+                max(latencies), sum(scores) / len(scores)))
+
+
+def main(args):
+    """Usage: python self_play.py [--games N] [--layout WWF|SCRABBLE]
+    [--seed N] [--workers N] [--engine best_plays|row_plays|gaddag_row_plays]
+    Play seeded games and print games/sec, moves/sec and move latencies."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='self_play.py')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default='WWF')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--engine', choices=sorted(ENGINES),
+                        default='best_plays')
+    options = parser.parse_args(args)
+    results, seconds = simulate(options.games, options.layout, options.seed,
+                                options.workers, ENGINES[options.engine])
+    print(report(results, seconds))
+
+
+def test():
+    "tests."
+    assert len(BAGS['SCRABBLE']) == 100 and len(BAGS['WWF']) == 104
+    assert percentile([3, 1, 2, 4], 50) == 2 and percentile([5], 99) == 5
+    assert percentile(list(range(1, 101)), 90) == 90
+    board = empty_board()
+    make_play((0, (2, 1), (1, 0), 'CAT'), board)
+    assert remove_tiles('_AXTRS', (0, (2, 1), (0, 1), 'CoATS'), board) == 'XR'
+    for layout in LAYOUTS:
+        game, again = play_game(layout, seed=1), play_game(layout, seed=1)
+        assert (game['scores'], game['moves']) == (again['scores'],
+                                                   again['moves'])
+        moves = game['moves']
+        assert len(game['latencies']) >= len(moves) > 10
+        played = sum(is_letter(sq) for row in game['board'] for sq in row)
+        assert played <= len(BAGS[layout])
+        assert sum(game['scores']) <= sum(play[0] for play in moves)
+    results, seconds = simulate(2, 'WWF', seed=1, workers=2)
+    assert [r['moves'] for r in results] == [
+        play_game('WWF', seed)['moves'] for seed in (1, 2)]
+    assert 'games/sec' in report(results, seconds)
+    print('tests pass')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        main(sys.argv[1:])
+    else:
+        test()
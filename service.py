@@ -0,0 +1,409 @@
+'''
+A local solver service.
+
+    python service.py serve [--host H] [--port P] [--workers N]
+    python service.py load [--port P] [--requests N] [--concurrency C]
+
+Requests and responses are JSON objects, one per line, over TCP:
+
+    {"id": 1, "op": "word_plays", "args": {"hand": "AB", "board_letters": "E"}}
+    {"id": 1, "result": ["AB", "ABE", ...]}   or   {"id": 1, "error": "..."}
+
+The ops are best_play, word_plays, boggle_words and anagrams (see OPS),
+and stats. The server keeps one lexicon_pool, whose workers load the
+lexicon once and keep their rack caches warm, and a cache of recent
+results. Identical requests that arrive while one is being solved wait
+for that solve instead of starting another. At most max_pending requests
+are in hand at once; past that the server stops reading, so clients are
+held back by TCP itself. Latency percentiles per op come from stats.
+'''
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+from collections import Counter, OrderedDict, deque
+
+from anagrams import memo_anagrams
+from boggle_game import as_board, fast_boggle_words
+from self_play import BAGS, LAYOUTS, percentile
+from word_game import a_board, best_play, word_plays
+from workers import lexicon_pool
+
+
+def solve_best_play(hand, board, layout=None):
+    """board is a list of row strings, as in a_board(); layout is 'WWF' or
+    'SCRABBLE' (default the BONUS layout)."""
+    bonus = LAYOUTS[layout] if layout else None
+    return best_play(hand, [list(row) for row in board], None, bonus)
+
+
+def solve_word_plays(hand, board_letters):
+    return sorted(word_plays(hand, board_letters))
+
+
+def solve_boggle_words(board):
+    "board is text rows ('PLAY THIS WORD GAME') or a Board() string."
+    return sorted(fast_boggle_words(as_board(board)))
+
+
+def solve_anagrams(phrase, shortest=2):
+    return sorted(memo_anagrams(phrase, shortest))
+
+
+OPS = {'best_play': solve_best_play, 'word_plays': solve_word_plays,
+       'boggle_words': solve_boggle_words, 'anagrams': solve_anagrams}
+
+
+def solve(op, args):
+    "The JSON-ready result of one request; run in a worker."
+    if op not in OPS:
+        raise ValueError('unknown op %r' % op)
+    return OPS[op](**args)
+
+
+class SolverServer(object):
+    """The service: solves requests in a pool of workers, solving identical
+    requests in flight together, caching the last cache_size results, and
+    reading no more requests while max_pending are in hand."""
+
+    def __init__(self, workers=None, max_pending=64, cache_size=1024):
+        self.pool = lexicon_pool(workers)
+        self.max_pending = max_pending
+        self.cache = OrderedDict()  # request key: result
+        self.cache_size = cache_size
+        self.solving = {}  # request key: future of its result
+        self.counts = Counter()
+        self.latencies = {}  # op: recent seconds per request
+        self.connections = {}  # writer: the task serving it
+        self.in_hand = 0  # requests read and not yet answered
+
+    async def start(self, host='127.0.0.1', port=0):
+        "Start listening; return the port."
+        self.pending = asyncio.Semaphore(self.max_pending)
+        self.server = await asyncio.start_server(self.serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        "Stop listening, end the open connections, and stop the workers."
+        self.server.close()
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*self.connections.values(),
+                             return_exceptions=True)
+        await self.server.wait_closed()
+        self.pool.shutdown()
+
+    async def serve(self, reader, writer):
+        "Answer the requests on one connection, as many at once as allowed."
+        lock = asyncio.Lock()
+        tasks = set()
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.pending.acquire()  # wait for room, reading no more
+                self.in_hand += 1
+                task = asyncio.ensure_future(self.respond(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def respond(self, line, writer, lock):
+        "Answer one request line, then make room for another."
+        t0 = time.perf_counter()
+        id, op = None, None
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('a request must be a JSON object')
+                id, op = request.get('id'), request['op']
+                response = dict(result=await self.call(
+                    op, request.get('args', {})))
+            except Exception as e:
+                self.counts['errors'] += 1
+                response = dict(error='%s: %s' % (type(e).__name__, e))
+            response['id'] = id
+            async with lock:
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:  # the client has gone
+            pass
+        finally:
+            self.in_hand -= 1
+            self.pending.release()
+        if isinstance(op, str) and op in OPS:
+            self.latencies.setdefault(op, deque(maxlen=10000)).append(
+                time.perf_counter() - t0)
+
+    async def call(self, op, args):
+        "op(**args): from the cache, from a solve in flight, or solved now."
+        if op == 'stats':
+            return self.stats()
+        if op not in OPS:
+            raise ValueError('unknown op %r' % op)
+        self.counts['requests'] += 1
+        key = json.dumps([op, args], sort_keys=True)
+        if key in self.cache:
+            self.counts['cache hits'] += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        if key in self.solving:
+            self.counts['coalesced'] += 1
+            return await asyncio.shield(self.solving[key])
+        self.counts['solves'] += 1
+        loop = asyncio.get_running_loop()
+        future = self.solving[key] = loop.run_in_executor(
+            self.pool, solve, op, args)
+        try:
+            result = await future
+        finally:
+            del self.solving[key]
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def stats(self):
+        "Counts, and each op's latency percentiles in milliseconds."
+        latency = {op: dict(count=len(times), **{
+            'p%d' % p: 1000 * percentile(times, p) for p in (50, 90, 99)})
+                   for op, times in self.latencies.items() if times}
+        return dict(counts=dict(self.counts), latency_ms=latency,
+                    in_hand=self.in_hand)
+
+
+class ServiceError(Exception):
+    "An error the service reported for a request."
+
+
+class Client(object):
+    """A connection to the service. Calls may overlap: each waits for the
+    response with its id."""
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+        self.ids = itertools.count(1)
+        self.waiting = {}  # id: future of the response
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def connect(cls, port, host='127.0.0.1'):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def call(self, op, **args):
+        "The result of op(**args), or raise ServiceError."
+        id = next(self.ids)
+        future = self.waiting[id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps(dict(id=id, op=op, args=args)).encode() +
+                          b'\n')
+        await self.writer.drain()
+        response = await future
+        if 'error' in response:
+            raise ServiceError(response['error'])
+        return response['result']
+
+    async def receive(self):
+        "Hand each response to the call waiting for it."
+        async for line in self.reader:
+            response = json.loads(line)
+            future = self.waiting.pop(response['id'], None)
+            if future is not None and not future.done():  # not cancelled
+                future.set_result(response)
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError('service closed'))
+
+    async def close(self):
+        self.writer.close()
+        await self.receiver
+
+
+def sample_requests(count, seed=0):
+    """count (op, args) requests, drawn from a small fixed mix so that some
+    of them repeat, as they do from real callers."""
+    rng = random.Random(seed)
+    board = [''.join(row) for row in a_board()]
+    hands = [''.join(rng.sample(BAGS['WWF'], 7)) for _ in range(20)]
+    boggle = [' '.join(''.join(rng.choice('AEIOURSTLNDCMPBG')
+                               for _ in range(4)) for _ in range(4))
+              for _ in range(20)]
+    phrases = ['ELECTRONIC', 'DORMITORY', 'ANAGRAMS', 'PROGRAMS', 'GAMES']
+    makers = [
+        lambda: ('best_play', dict(hand=rng.choice(hands), board=board)),
+        lambda: ('word_plays', dict(hand=rng.choice(hands).replace('_', 'E'),
+                                    board_letters='ETAOIN')),
+        lambda: ('boggle_words', dict(board=rng.choice(boggle))),
+        lambda: ('anagrams', dict(phrase=rng.choice(phrases)))]
+    return [rng.choice(makers)() for _ in range(count)]
+
+
+async def load_test(port, requests=200, concurrency=8, seed=0):
+    """Send sample_requests from concurrency clients at once. Return the
+    seconds taken, each op's latencies seen by the clients, and the
+    server's stats."""
+    work = deque(sample_requests(requests, seed))
+    latencies = {}
+
+    async def run_client():
+        client = await Client.connect(port)
+        while work:
+            op, args = work.popleft()
+            t0 = time.perf_counter()
+            await client.call(op, **args)
+            latencies.setdefault(op, []).append(time.perf_counter() - t0)
+        await client.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[run_client() for _ in range(concurrency)])
+    seconds = time.perf_counter() - t0
+    client = await Client.connect(port)
+    stats = await client.call('stats')
+    await client.close()
+    return seconds, latencies, stats
+
+
+def report(seconds, latencies, stats):
+    "A summary of a load_test."
+    total = sum(map(len, latencies.values()))
+    lines = ['%d requests in %.2f sec: %.1f requests/sec' % (
+        total, seconds, total / seconds)]
+    for op, times in sorted(latencies.items()):
+        lines.append('%-14s %5d  p50 %7.1f ms  p90 %7.1f ms  p99 %7.1f ms' % (
+            op, len(times), 1000 * percentile(times, 50),
+            1000 * percentile(times, 90), 1000 * percentile(times, 99)))
+    lines.append('server: %s' % ', '.join(
+        '%s %d' % item for item in sorted(stats['counts'].items())))
+    return '\n'.join(lines)
+
+
+async def serve_forever(host, port, workers, max_pending):
+    server = SolverServer(workers, max_pending)
+    port = await server.start(host, port)
+    print('serving on %s:%d' % (host, port))
+    await server.server.serve_forever()
+
+
+async def run_load(port, requests, concurrency, workers):
+    "load_test against the server on port, or if none, one started here."
+    server = None
+    if port is None:
+        server = SolverServer(workers)
+        port = await server.start()
+    try:
+        return report(*await load_test(port, requests, concurrency))
+    finally:
+        if server:
+            await server.close()
+
+
+def main(args):
+    """Usage: python service.py serve [--host H] [--port P] [--workers N]
+    [--max-pending N]; or python service.py load [--port P] [--requests N]
+    [--concurrency C] [--workers N], which starts a server of its own if no
+    port is given, and prints requests/sec and latency percentiles."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='service.py')
+    parser.add_argument('command', choices=['serve', 'load'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-pending', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    options = parser.parse_args(args)
+    if options.command == 'serve':
+        asyncio.run(serve_forever(options.host, options.port or 8765,
+                                  options.workers, options.max_pending))
+    else:
+        print(asyncio.run(run_load(options.port, options.requests,
+                                   options.concurrency, options.workers)))
+
+
+def test():
+    "tests."
+    import gc
+
+    async def check():
+        unhandled = []
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: unhandled.append(context))
+        server = SolverServer(workers=2, max_pending=4, cache_size=2)
+        port = await server.start()
+        # Connections that send nothing hold no room for requests.
+        idle = [await asyncio.open_connection('127.0.0.1', port)
+                for _ in range(server.max_pending)]
+        client = await Client.connect(port)
+        board = [''.join(row) for row in a_board()]
+        assert await client.call('best_play', hand='ABCEHKN',
+                                 board=board) == [64, [3, 2], [1, 0],
+                                                  'BACKBENCH']
+        assert await client.call('word_plays', hand='ABC',
+                                 board_letters='E') == solve_word_plays(
+                                     'ABC', 'E')
+        assert 'TEST' in await client.call('boggle_words',
+                                           board='XXXX TEST XXXX XXXX')
+        assert 'IT IT SEEN' in await client.call('anagrams',
+                                                 phrase='ENTITIES')
+        try:
+            await client.call('nonsense')
+            raise AssertionError('expected a ServiceError')
+        except ServiceError as e:
+            assert 'unknown op' in str(e)
+        # Ten identical requests at once: one solve, nine waiting for it.
+        results = await asyncio.gather(*[
+            client.call('anagrams', phrase='DORMITORY') for _ in range(10)])
+        assert all(result == results[0] for result in results)
+        stats = await client.call('stats')
+        assert stats['counts']['coalesced'] + stats['counts'].get(
+            'cache hits', 0) == 9
+        assert stats['counts']['solves'] == 5
+        assert stats['latency_ms']['anagrams']['count'] == 11
+        await client.call('anagrams', phrase='DORMITORY')
+        stats = await client.call('stats')
+        assert stats['counts']['cache hits'] >= 1
+        await client.close()
+        # Lines that are not request objects get errors, and free their slot.
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'[1, 2]\nnull\n5\n"op"\n{}\n'
+                     b'{"id": 1, "op": ["x"]}\n')
+        errors = [json.loads(await reader.readline()) for _ in range(6)]
+        assert [e['id'] for e in errors] == [None] * 5 + [1]
+        assert all('error' in e for e in errors)
+        writer.close()
+        assert server.in_hand == 0
+        client = await Client.connect(port)
+        assert await client.call('word_plays', hand='ABC', board_letters='E')
+        # A call given up by its caller leaves the client working.
+        try:
+            await asyncio.wait_for(client.call('anagrams', phrase='STOP'),
+                                   0.001)
+        except asyncio.TimeoutError:
+            pass
+        assert await client.call('anagrams', phrase='POTS')
+        await client.close()
+        for reader, writer in idle:
+            writer.close()
+        seconds, latencies, stats = await load_test(port, 40, 6)
+        assert sum(map(len, latencies.values())) == 40
+        assert 'requests/sec' in report(seconds, latencies, stats)
+        await server.close()
+        gc.collect()
+        assert not unhandled, unhandled
+
+    asyncio.run(check())
+    print('tests pass')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:]:
+        main(sys.argv[1:])
+    else:
+        test()
@@ -1,7 +1,18 @@
 '''
 Word game.
 '''
+import heapq
+import itertools
+import os
+import threading
 import time
+from array import array
+from collections import Counter, OrderedDict
+
+from instrument import collecting, counted, current_stats, phase, timed
+from letter_index import index_for, is_plain
+from lexicon import SEPARATOR, current_lexicon
+from workers import lexicon_pool, ordered_map
 
 
 def prefixes(word):
@@ -9,17 +20,15 @@ def prefixes(word):
     return [word[:i] for i in range(len(word))]
 
 
-def readwordlist(filename):
-    """Read the words from a file and return a set of the words
-    and a set of the prefixes."""
-    file = open(filename)  # opens file
-    text = file.read()  # gets file into string
-    wordset = set(text.upper().split())
-    prefixset = set(prefix for word in wordset for prefix in prefixes(word))
-    return wordset, prefixset
+def __getattr__(name):
+    "WORDS and PREFIXES are the current lexicon, loaded on first use."
+    if name == 'WORDS':
+        return current_lexicon()
+    if name == 'PREFIXES':
+        return current_lexicon().prefixes
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
-WORDS, PREFIXES = readwordlist('words4k.txt')
 space_trans = str.maketrans('abcdefghijklmnopqrstuvwxyz', '_' * 26)
 
 
@@ -29,88 +38,236 @@ def removed(letters, word):
     return letters
 
 
+def rack(letters):
+    """The multiset of letters as a {letter: count} dict. Searches branch once
+    per distinct letter (or blank), not once per tile."""
+    return Counter(letters)
+
+
+class RackCache(object):
+    """A bounded cache of results computed from a rack, shared by all threads.
+    A key is (kind, rack, lexicon), with the rack's letters sorted, so every
+    ordering of the same tiles shares an entry. Results are frozensets, safe
+    to hand to every caller. When more than maxsize entries are held, the
+    least recently used is dropped."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, kind, letters, compute):
+        "The cached compute(letters) for this kind, computing it on a miss."
+        key = (kind, ''.join(sorted(letters)), current_lexicon())
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        result = frozenset(compute(letters))  # outside the lock
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return result
+
+    def resize(self, maxsize):
+        "Hold at most maxsize entries from now on."
+        with self.lock:
+            self.maxsize = maxsize
+            while len(self.entries) > maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        "Drop every entry, and reset the counters."
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        "A dict of the hits, misses, current size and maxsize."
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        size=len(self.entries), maxsize=self.maxsize)
+
+
+rack_cache = RackCache()  # for find_words and find_prefixes
+
+
 def find_words(letters, pre='', results=None):
+    """Find all words that can be made from letters, starting with pre.
+    Without pre or results, the (frozen) set comes from rack_cache."""
+    if pre == '' and results is None:
+        return rack_cache.get('words', letters, find_words_uncached)
+    return find_words_uncached(letters, pre, results)
+
+
+INDEX_MIN_LETTERS = 7  # fewer letters are quicker to walk in the lexicon
+
+
+def find_words_uncached(letters, pre='', results=None):
+    """Find all words that can be made from letters, starting with pre.
+    Without pre, they come from the letter index when there is one and
+    there are at least INDEX_MIN_LETTERS letters, all plain."""
     if results is None:
         results = set()
+    index = (index_for() if not pre and len(letters) >= INDEX_MIN_LETTERS
+             and is_plain(letters) else None)
+    if index is not None:
+        results.update(index.find_words(letters, blanks=0))
+        return results
+    return lexicon_words(letters, pre, results)
 
-    if pre in WORDS: results.add(pre)
-    if pre in PREFIXES:
-        for L in letters:
-            find_words(letters.replace(L, '', 1), pre + L, results)
 
+def lexicon_words(letters, pre='', results=None):
+    "Find the words from letters, starting with pre, by walking the lexicon."
+    if results is None:
+        results = set()
+    WORDS = current_lexicon()
+    counts = rack(letters)
+
+    def extend(pre, node):
+        if WORDS.is_word(node): results.add(pre)
+        for L, n in counts.items():
+            if n:
+                child = WORDS.child(node, L)
+                if child is not None:
+                    counts[L] = n - 1
+                    extend(pre + L, child)
+                    counts[L] = n
+
+    node = WORDS.node(pre)
+    if node is not None:
+        extend(pre, node)
     return results
 
 
+def find_words_batch(racks):
+    """[find_words(rack) for rack in racks], as uncached sets; with the letter
+    index, all found at once."""
+    index = index_for()
+    if index is None:
+        return [find_words_uncached(rack) for rack in racks]
+    plain = [rack for rack in racks if is_plain(rack)]
+    found = iter(index.find_words_batch(plain, blanks=0))
+    return [next(found) if is_plain(rack) else lexicon_words(rack)
+            for rack in racks]
+
+
 def word_plays(hand, board_letters):
     "Find all word plays from hand that can be made to abut with a letter on board."
+    index = index_for()
+    letters = hand + ''.join(board_letters)
+    if index is not None and is_plain(letters):
+        return index.word_plays(hand, board_letters)
     # Find prefix + L + suffix; L from board_letters, rest from hand
     results = set()
-    for pre in find_prefixes(hand, '', set()):
+    for pre in find_prefixes(hand):
         for L in board_letters:
             add_suffixes1(removed(hand, pre), pre + L, results)
     return results
 
 
-prev_hand, prev_results = '', set()  # cache for find_prefixes
+@timed()
+def find_prefixes(hand, pre='', results=None):
+    """Find all prefixes (of words) that can be made from letters in hand.
+    Without pre or results, the (frozen) set comes from rack_cache."""
+    if pre == '' and results is None:
+        return rack_cache.get('prefixes', hand, find_prefixes_uncached)
+    return find_prefixes_uncached(hand, pre, results)
 
 
-def find_prefixes(hand, pre='', results=None):
+def find_prefixes_uncached(hand, pre='', results=None):
     "Find all prefixes (of words) that can be made from letters in hand."
-    global prev_hand, prev_results
-    if prev_hand == hand:
-        return prev_results
     if results is None: results = set()
-    if pre == '':
-        prev_hand, prev_results = hand, results
-    if pre.upper() in PREFIXES:
-        results.add(pre)
-        for L in hand:
-            if L == '_':
-                for l in LOWER_LETTERS:
-                    find_prefixes(hand.replace(L, '', 1), pre + l, results)
-            else:
-                find_prefixes(hand.replace(L, '', 1), pre + L, results)
+    WORDS = counted(current_lexicon())
+    counts = rack(hand)
+
+    def extend(pre, node):
+        if WORDS.has_children(node):
+            results.add(pre)
+            for L, n in counts.items():
+                if n:
+                    counts[L] = n - 1
+                    if L == '_':
+                        for l, child in WORDS.children(node):
+                            extend(pre + l.lower(), child)
+                    else:
+                        child = WORDS.child(node, L)
+                        if child is not None:
+                            extend(pre + L, child)
+                    counts[L] = n
+
+    node = WORDS.node(pre.upper())
+    if node is not None:
+        extend(pre, node)
     return results
 
 
 def add_suffixes1(hand, pre, results):
     """Return the set of words that can be formed by extending pre with letters in hand."""
-    if pre in WORDS:
-        results.add(pre)
-    if pre in PREFIXES:
-        for L in hand:
-            add_suffixes1(hand.replace(L, '', 1), pre + L, results)
+    WORDS = current_lexicon()
+    counts = rack(hand)
+
+    def extend(pre, node):
+        if WORDS.is_word(node):
+            results.add(pre)
+        for L, n in counts.items():
+            if n:
+                child = WORDS.child(node, L)
+                if child is not None:
+                    counts[L] = n - 1
+                    extend(pre + L, child)
+                    counts[L] = n
+
+    node = WORDS.node(pre)
+    if node is not None:
+        extend(pre, node)
     return results
 
 
+@timed()
 def add_suffixes(hand, pre, start, row, results, anchored=True):
     "Add all possible suffixes, and accumulate (start, word) pairs in results."
-    i = start + len(pre)
-    PRE = pre.upper()
-    if PRE in WORDS and anchored and not is_letter(row[i]):
-        results.add((start, pre))
-    if PRE in PREFIXES:
+    WORDS = counted(current_lexicon())
+    counts = rack(hand)
+
+    def extend(pre, node, anchored=True):
+        i = start + len(pre)
+        if WORDS.is_word(node) and anchored and not is_letter(row[i]):
+            results.add((start, pre))
         sq = row[i]
         if is_letter(sq):
-            add_suffixes(hand, pre + sq, start, row, results)
+            child = WORDS.child(node, sq.upper())
+            if child is not None:
+                extend(pre + sq, child)
         elif is_empty(sq):
             possibilities = sq if isinstance(sq, set) else ANY
-            for L in hand:
-                if L in possibilities:
-                    add_suffixes(
-                        hand.replace(L, '', 1), pre + L, start, row, results)
-                elif L == '_':
-                    for l in possibilities:
-                        add_suffixes(
-                            hand.replace(L, '', 1), pre + l.lower(), start,
-                            row, results)
+            for L, n in counts.items():
+                if n:
+                    counts[L] = n - 1
+                    if L in possibilities:
+                        child = WORDS.child(node, L)
+                        if child is not None:
+                            extend(pre + L, child)
+                    elif L == '_':
+                        for l, child in WORDS.children(node):
+                            if l in possibilities:
+                                extend(pre + l.lower(), child)
+                    counts[L] = n
+
+    node = WORDS.node(pre.upper())
+    if node is not None:
+        extend(pre, node, anchored)
     return results
 
 
-def longest_words(hand, board_letters):
-    "Return all word plays, longest first."
-    words = word_plays(hand, board_letters)
-    return sorted(words, key=len, reverse=True)
+def longest_words(hand, board_letters, n=None):
+    "Return all word plays (or the n longest), longest first."
+    return best_word_plays(hand, board_letters, n, LENGTHS)
 
 
 POINTS = dict(
@@ -150,13 +307,134 @@ def word_score(word):
 
 def topn(hand, board_letters, n=10):
     "Return a list of the top n words that hand can play, sorted by word score."
-    words = sorted(
-        word_plays(hand, board_letters), key=word_score, reverse=True)
-    return words[:n]
+    return best_word_plays(hand, board_letters, n)
+
+
+def best_word_plays(hand, board_letters, n=None, points=POINTS):
+    """The n words of word_plays(hand, board_letters) (all, if n is None)
+    with the most points, ties in alphabetical order. With the letter index,
+    they are picked from the vectorized word_plays; otherwise the best-first
+    search finds just the first n."""
+    if index_for() is None or not is_plain(hand + ''.join(board_letters)):
+        return list(itertools.islice(
+            iter_word_plays(hand, board_letters, points, n), n))
+    words = word_plays(hand, board_letters)
+
+    def key(word):
+        return (-sum(points[L] for L in word), word)
+
+    return sorted(words, key=key) if n is None else heapq.nsmallest(
+        n, words, key)
+
+
+LENGTHS = dict.fromkeys('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 1)  # points for length
+
+
+def most_points(lexicon, points):
+    """A function of a node of lexicon: the most points that the letters on
+    a path from it to a word end can have. Remembered on the lexicon (as its
+    heights are), so it goes when the lexicon does."""
+    memos = getattr(lexicon, 'most_points_memo', None)
+    if memos is None:
+        memos = lexicon.most_points_memo = {}  # points items: function
+    key = tuple(sorted(points.items()))
+    if key not in memos:
+        memo = {}
+
+        def most(node):
+            if node not in memo:
+                memo[node] = max((points.get(L, 0) + most(child)
+                                  for L, child in lexicon.children(node)),
+                                 default=0)
+            return memo[node]
+
+        memos[key] = most
+    return memos[key]
+
+
+def iter_word_plays(hand, board_letters, points=POINTS, n=None):
+    """Generate the words of word_plays(hand, board_letters) lazily, the most
+    points first (ties in alphabetical order). The search is best first: a
+    heap of partial words, each ranked by its points so far plus the most
+    its unused tiles (and a board letter, if it has not used one yet) could
+    add in as many more letters as the lexicon allows. A word is yielded
+    once no partial word can beat it, so taking the first n costs about n
+    words' worth of search, not all of them. Blanks are not used, as in
+    word_plays. Given n, only the first n words are wanted: partial words
+    and words that cannot be among them are not kept."""
+    if n is not None and n <= 0:
+        return
+    WORDS = current_lexicon()
+    most = most_points(WORDS, points)
+    tiles = tuple(sorted((L for L in hand if L in points),
+                         key=lambda L: (-points[L], L)))
+    board = tuple(sorted(set(L for L in board_letters if L in points)))
+    top = max((points[L] for L in board), default=0)
+
+    def bound(score, node, tiles, board):
+        """The most points a word reached from this partial word can have:
+        no more than any word in the lexicon gets from here, nor than the
+        best of its letters left can add in the room there is."""
+        room = WORDS.height(node)
+        if board:  # one letter must still come from the board
+            left = top + sum(points[L] for L in tiles[:max(0, room - 1)])
+        else:
+            left = sum(points[L] for L in tiles[:room])
+        return score + min(left, most(node))
+
+    # Entries are (-bound, 0, word, node, tiles, board, points) for a partial
+    # word, and (-points, 1, word) for a word; partial words go first on ties.
+    frontier = [(-bound(0, WORDS.root, tiles, board), 0, '', WORDS.root,
+                 tiles, board, 0)] if board else []
+    found = set()
+    pushed, floor = set(), []  # words pushed; the n best of their points
+
+    def keep(limit):
+        "Can a word of at most limit points still be among the first n?"
+        return n is None or len(floor) < n or limit >= floor[0]
+
+    while frontier:
+        entry = heapq.heappop(frontier)
+        if entry[1]:
+            if entry[2] not in found:
+                found.add(entry[2])
+                yield entry[2]
+            continue
+        _, _, word, node, tiles, board, score = entry
+        # The next letter is a tile (each letter once; equal ones are next to
+        # each other in tiles), or a letter on the board.
+        for i, L in enumerate(tiles + board):
+            if i < len(tiles):
+                if i and L == tiles[i - 1]:
+                    continue
+                rest, board_left = tiles[:i] + tiles[i + 1:], board
+            else:
+                rest, board_left = tiles, ()
+            child = WORDS.child(node, L)
+            if child is None:
+                continue
+            more = score + points[L]
+            if (not board_left and WORDS.is_word(child) and keep(more)
+                    and word + L not in pushed):
+                heapq.heappush(frontier, (-more, 1, word + L))
+                if n is not None:
+                    pushed.add(word + L)
+                    if len(floor) < n:
+                        heapq.heappush(floor, more)
+                    else:
+                        heapq.heappushpop(floor, more)
+            if (rest or board_left) and WORDS.has_children(child):
+                limit = bound(more, child, rest, board_left)
+                if keep(limit):
+                    heapq.heappush(frontier, (-limit, 0, word + L, child, rest,
+                                              board_left, more))
 
 
 class anchor(set):
-    "An anchor is where a new word can be placed; has a set of allowable letters."
+    """An anchor is where a new word can be placed; has a set of allowable
+    letters. If a cross word runs through it, cross_points is the total of
+    the letters of the cross word that are already on the board."""
+    cross_points = None
 
 
 LETTERS = list('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
@@ -166,8 +444,11 @@ for L in LOWER_LETTERS:
     POINTS[L] = 0
 
 
+TILES = set(LETTERS + LOWER_LETTERS)  # a lowercase tile is a played blank
+
+
 def is_letter(sq):
-    return isinstance(sq, str) and sq in LETTERS
+    return isinstance(sq, str) and sq in TILES
 
 
 def is_empty(sq):
@@ -190,6 +471,7 @@ def legal_prefix(i, row):
     return ('', i - s)
 
 
+@timed()
 def row_plays(hand, row):
     "Return a set of legal plays in row.  A row play is an (start, 'WORD') pair."
     results = set()
@@ -214,19 +496,86 @@ def row_plays(hand, row):
     return results
 
 
-def horizontal_plays(hand, board):
-    "Find all horizontal plays -- (score, (i, j), word) pairs -- across all rows."
+@timed()
+def gaddag_row_plays(hand, row):
+    """The same set as row_plays(hand, row), found with the GADDAG. From each
+    anchor a word grows to the left (spelled backwards in the GADDAG) over
+    board letters and free squares, then crosses the separator and grows to
+    the right. It may not grow onto another anchor on the left; the plays
+    through that anchor are grown from there."""
+    GADDAG = counted(current_lexicon().gaddag())
+    counts = rack(hand)
+    results = set()
+
+    def tiles(node, sq):
+        """Yield (L, child) for each way to fill sq from node: the board letter
+        on it, or a tile from the hand that fits (used up while yielded)."""
+        if is_letter(sq):
+            child = GADDAG.child(node, sq.upper())
+            if child is not None:
+                yield sq, child
+            return
+        possibilities = sq if isinstance(sq, set) else ANY
+        for L, n in counts.items():
+            if n:
+                counts[L] = n - 1
+                if L in possibilities:
+                    child = GADDAG.child(node, L)
+                    if child is not None:
+                        yield L, child
+                elif L == '_':
+                    for l, child in GADDAG.children(node):
+                        if l in possibilities:
+                            yield l.lower(), child
+                counts[L] = n
+
+    def left(start, end, node, front):
+        "front is on row[start:end]; extend it leftward, or turn right."
+        sq = row[start - 1]
+        if is_letter(sq) or (is_empty(sq) and not isinstance(sq, anchor)):
+            for L, child in tiles(node, sq):
+                left(start - 1, end, child, L + front)
+        if not is_letter(sq):
+            node = GADDAG.child(node, SEPARATOR)
+            if node is not None:
+                right(start, end, node, front)
+
+    def right(start, end, node, word):
+        "word is on row[start:end]; record it, and extend it rightward."
+        sq = row[end]
+        if GADDAG.is_word(node) and not is_letter(sq):
+            results.add((start, word))
+        if is_letter(sq) or is_empty(sq):
+            for L, child in tiles(node, sq):
+                right(start, end + 1, child, word + L)
+
+    for (i, sq) in enumerate(row[1:-1], 1):
+        if isinstance(sq, set):
+            for L, child in tiles(GADDAG.root, sq):
+                left(i, i + 1, child, L)
+    return results
+
+
+def horizontal_plays(hand, board, bonus=None, engine=None):
+    """Find all horizontal plays -- (score, (i, j), word) pairs -- across all rows.
+    bonus is the layout of bonus squares for this board (default BONUS), and
+    engine the function that finds the plays in a row (default row_plays)."""
+    if engine is None: engine = row_plays
     results = set()
     for (j, row) in enumerate(board[1:-1], 1):
         set_anchors(row, j, board)
-        for i, word in row_plays(hand, row):
-            score = calculate_score(board, (i, j), ACROSS, hand, word)
-            results.add((score, (i, j), word))
+        plays = engine(hand, row)
+        with phase('calculate_score'):
+            for i, word in plays:
+                score = calculate_score(board, (i, j), ACROSS, hand, word,
+                                        bonus)
+                results.add((score, (i, j), word))
     return results
 
 
-def calculate_score(board, pos, direction, hand, word):
+def calculate_score(board, pos, direction, hand, word, bonus=None):
     "Return the total score for this play."
+    if bonus is None: bonus = BONUS
     total, crosstotal, word_mult = 0, 0, 1
     starti, startj = pos
     di, dj = direction
@@ -234,24 +583,32 @@ def calculate_score(board, pos, direction, hand, word):
     for n, L in enumerate(word):
         i, j = starti + n * di, startj + n * dj
         sq = board[j][i]
-        b = BONUS[j][i]
-        word_mult *= 1 if is_letter(sq) else 3 if b == TW else 2 if b in (
+        b = bonus[j][i]
+        square_mult = 1 if is_letter(sq) else 3 if b == TW else 2 if b in (
             DW, '*') else 1
+        word_mult *= square_mult
         letter_mult = 1 if is_letter(
             sq) else 3 if b == TL else 2 if b == DL else 1
         total += POINTS[L] * letter_mult
         if isinstance(sq, anchor) and sq is not ANY and direction is not DOWN:
-            crosstotal += cross_word_score(board, L, (i, j), other_direction)
+            if sq.cross_points is None:
+                crosstotal += cross_word_score(board, L, (i, j),
+                                               other_direction, bonus)
+            else:  # the cross word's letters, with the new one, on sq
+                crosstotal += square_mult * (sq.cross_points +
+                                             POINTS[L] * letter_mult)
     return crosstotal + total * word_mult
 
 
-def cross_word_score(board, L, pos, direction):
+def cross_word_score(board, L, pos, direction, bonus=None):
     "Return the score of a word made in the other direction from the main word."
     i, j = pos
     j2, word = find_cross_word(board, i, j)
-    return calculate_score(board, (i, j2), DOWN, L, word.replace('.', L))
+    return calculate_score(board, (i, j2), DOWN, L, word.replace('.', L),
+                           bonus)
 
 
+@timed()
 def transpose(matrix):
     "Transpose e.g. [[1,2,3], [4,5,6]] to [[1, 4], [2, 5], [3, 6]]"
     # or [[M[j][i] for j in range(len(M))] for i in range(len(M[0]))]
@@ -261,17 +618,68 @@ def transpose(matrix):
 ACROSS, DOWN = (1, 0), (0, 1)  # Directions that words can go
 
 
-def all_plays(hand, board):
+@timed()
+def all_plays(hand, board, engine=None, bonus=None):
     """All plays in both directions. A play is a (score, pos, dir, word) tuple,
-    where pos is an (i, j) pair, and dir is ACROSS or DOWN."""
-    hplays = horizontal_plays(hand, board)  # set of ((i, j), word)
-    vplays = horizontal_plays(hand, transpose(board))  # set of ((j, i), word)
+    where pos is an (i, j) pair, and dir is ACROSS or DOWN. engine finds the
+    plays in a row: row_plays (the default) or gaddag_row_plays."""
+    if bonus is None: bonus = BONUS
+    hplays = horizontal_plays(hand, board, bonus,
+                              engine)  # set of ((i, j), word)
+    vplays = horizontal_plays(hand, transpose(board), transpose(bonus),
+                              engine)  # set of ((j, i), word)
     return set((score, (i, j), ACROSS, word)
                for score, (i, j), word in hplays) | set(
                    (score, (j, i), DOWN, word)
                    for score, (i, j), word in vplays)
 
 
+def parallel_all_plays(hand, board, engine=None, bonus=None, pool=None,
+                       chunks=None):
+    """The same set as all_plays(hand, board, engine, bonus), with the rows of
+    the board and of its transpose searched by a pool of workers (default:
+    a new lexicon_pool, which shares the current lexicon). Anchors are set
+    here, and the workers get read-only copies of the rows, in chunks (by
+    default, two per CPU); their plays are scored and merged here, in row
+    order."""
+    if engine is None: engine = row_plays
+    if bonus is None: bonus = BONUS
+    rows = []  # (direction, j, row) for each row with an anchor
+    for j, row in enumerate(board[1:-1], 1):
+        set_anchors(row, j, board)
+    grids = {ACROSS: (board, bonus), DOWN: (transpose(board), transpose(bonus))}
+    for direction, (grid, _) in grids.items():
+        for j, row in enumerate(grid[1:-1], 1):
+            if direction == DOWN:
+                set_anchors(row, j, grid)
+            if any(isinstance(sq, set) for sq in row):
+                rows.append((direction, j, row))
+    if pool is None:
+        with lexicon_pool() as pool:
+            return parallel_all_plays(hand, board, engine, bonus, pool, chunks)
+    if chunks is None:
+        chunks = 2 * (os.cpu_count() or 1)
+    size = max(1, -(-len(rows) // chunks))
+    tasks = [(hand, [row for _, _, row in rows[n:n + size]], engine)
+             for n in range(0, len(rows), size)]
+    results = set()
+    found = itertools.chain.from_iterable(
+        ordered_map(pool, rows_plays, tasks))
+    for (direction, j, row), plays in zip(rows, found):
+        grid, grid_bonus = grids[direction]
+        for i, word in plays:
+            score = calculate_score(grid, (i, j), ACROSS, hand, word,
+                                    grid_bonus)
+            results.add((score, (i, j) if direction == ACROSS else (j, i),
+                         direction, word))
+    return results
+
+
+def rows_plays(hand, rows, engine):
+    "The set of plays engine(hand, row) for each row; a parallel_all_plays task."
+    return [engine(hand, row) for row in rows]
+
+
 def make_play(play, board):
     "Put the word down on the board."
     (score, (i, j), (di, dj), word) = play
@@ -283,10 +691,31 @@ def make_play(play, board):
 NOPLAY = None
 
 
-def best_play(hand, board):
-    "Return the highest-scoring play.  Or None."
-    plays = all_plays(hand, board)
-    return sorted(plays)[-1] if plays else NOPLAY
+@timed()
+def best_play(hand, board, engine=None, bonus=None):
+    """Return the highest-scoring play.  Or None. With no engine given, this
+    is the branch-and-bound search of best_plays."""
+    if engine is None:
+        plays = best_plays(hand, board, 1, bonus)
+        return plays[0] if plays else NOPLAY
+    plays = all_plays(hand, board, engine, bonus)
+    return max(plays) if plays else NOPLAY
+
+
+def anytime_best_play(hand, board, deadline=None, cancel=None, bonus=None):
+    """best_play(hand, board), within a time budget: the most promising
+    anchors are searched first, and the search stops once time.monotonic()
+    passes deadline or cancel (a threading.Event) is set. Return (the best
+    play found, or None; whether the search finished)."""
+    plays, finished = CompactBoard(board, bonus).search(hand, 1, deadline,
+                                                        cancel)
+    return (plays[0] if plays else NOPLAY), finished
+
+
+def best_plays(hand, board, k=1, bonus=None):
+    """The k highest-scoring plays, highest first; the same as the first k of
+    sorted(all_plays(hand, board), reverse=True), without making them all."""
+    return CompactBoard(board, bonus).best_plays(hand, k)
 
 
 def find_cross_word(board, i, j):
@@ -311,20 +740,474 @@ def neighbors(board, i, j):
     return [board[j - 1][i], board[j + 1][i], board[j][i + 1], board[j][i - 1]]
 
 
+def cross_letters(w):
+    """The letters L for which w.replace('.', L) is a word, found by walking
+    the lexicon along the letters above the gap and then below it."""
+    WORDS = current_lexicon()
+    above, below = w.upper().split('.')
+    node = WORDS.node(above)
+    if node is None:
+        return []
+    letters = []
+    for L, child in WORDS.children(node):
+        end = WORDS.walk(child, below)
+        if end is not None and WORDS.is_word(end):
+            letters.append(L)
+    return letters
+
+
+@timed()
 def set_anchors(row, j, board):
     """Anchors are empty squares with a neighboring letter. Some are resticted
     by cross-words to be only a subset of letters."""
-    for (i, sq) in enumerate(row[1:-1], 1):
-        neighborlist = (N, S, E, W) = neighbors(board, i, j)
-        # Anchors are squares adjacent to a letter.  Plus the '*' square.
-        if sq == '*' or (is_empty(sq) and any(map(is_letter, neighborlist))):
-            if is_letter(N) or is_letter(S):
-                # Find letters that fit with the cross (vertical) word
-                (j2, w) = find_cross_word(board, i, j)
-                row[i] = anchor(
-                    L for L in LETTERS if w.replace('.', L) in WORDS)
-            else:  # Unrestricted empty square -- any letter will fit.
-                row[i] = ANY
+    for i in range(1, len(row) - 1):
+        set_anchor(board, i, j)
+
+
+def set_anchor(board, i, j):
+    "Make board[j][i] an anchor, if it is one (see set_anchors)."
+    sq = board[j][i]
+    neighborlist = (N, S, E, W) = neighbors(board, i, j)
+    # Anchors are squares adjacent to a letter.  Plus the '*' square.
+    if sq == '*' or (is_empty(sq) and any(map(is_letter, neighborlist))):
+        if is_letter(N) or is_letter(S):
+            # Find letters that fit with the cross (vertical) word
+            (j2, w) = find_cross_word(board, i, j)
+            sq = board[j][i] = anchor(cross_letters(w))
+            sq.cross_points = word_score(w.replace('.', ''))
+        else:  # Unrestricted empty square -- any letter will fit.
+            board[j][i] = ANY
+
+
+class BoardState(object):
+    """A board that keeps its anchors for both directions. The across grid
+    is the board with across anchors set; the down grid is the transposed
+    board with down anchors set. make_play updates both, recomputing
+    anchors only in the rows and columns that the new tiles touched (no
+    other square's neighbors or cross word can have changed). engine finds
+    the plays in a row, as for all_plays."""
+
+    def __init__(self, board, bonus=None, engine=None):
+        self.bonus = BONUS if bonus is None else bonus
+        self.engine = row_plays if engine is None else engine
+        board = [[sq if not isinstance(sq, anchor) else
+                  '*' if self.bonus[j][i] == '*' else '.'
+                  for (i, sq) in enumerate(row)]
+                 for (j, row) in enumerate(board)]
+        self.grids = {ACROSS: board, DOWN: transpose(board)}
+        self.bonuses = {ACROSS: self.bonus, DOWN: transpose(self.bonus)}
+        for grid in self.grids.values():
+            for j in range(1, len(grid) - 1):
+                set_anchors(grid[j], j, grid)
+
+    @property
+    def board(self):
+        "The board, with across anchors."
+        return self.grids[ACROSS]
+
+    def all_plays(self, hand):
+        "The same set as all_plays(hand, board), without setting any anchors."
+        results = set()
+        for direction, grid in self.grids.items():
+            bonus = self.bonuses[direction]
+            for (j, row) in enumerate(grid[1:-1], 1):
+                for i, word in self.engine(hand, row):
+                    score = calculate_score(grid, (i, j), ACROSS, hand, word,
+                                            bonus)
+                    pos = (i, j) if direction == ACROSS else (j, i)
+                    results.add((score, pos, direction, word))
+        return results
+
+    def best_play(self, hand):
+        "Return the highest-scoring play.  Or None."
+        plays = self.all_plays(hand)
+        return sorted(plays)[-1] if plays else NOPLAY
+
+    def make_play(self, play):
+        "Put the word down on the board, and update the anchors it affects."
+        (score, (i, j), (di, dj), word) = play
+        squares = [(i + di * n, j + dj * n) for n in range(len(word))]
+        across, down = self.grids[ACROSS], self.grids[DOWN]
+        for (x, y), L in zip(squares, word):
+            across[y][x] = down[x][y] = L
+        columns = set(x for x, y in squares)
+        rows = set(y for x, y in squares)
+        for grid, lines, crossing in [(across, rows, columns),
+                                      (down, columns, rows)]:
+            for y in lines:
+                for x in range(1, len(grid[y]) - 1):
+                    set_anchor(grid, x, y)
+            for x in crossing:
+                for y in range(1, len(grid) - 1):
+                    set_anchor(grid, x, y)
+        return self
+
+
+BITS = {L: 1 << n for n, L in enumerate(LETTERS)}  # a letter's bit in a mask
+ALL_BITS = (1 << 26) - 1
+ANCHOR, CROSS = 1 << 26, 1 << 27  # flags beside the letter bits: an anchor;
+# a cross word runs through this square
+IS_TILE = bytes(chr(c) in TILES for c in range(256))
+UPPER = [chr(c).upper() for c in range(256)]
+
+
+class CompactBoard(object):
+    """A board stored flat: a bytearray of squares (the characters of a list
+    board, with no anchor objects), and for each direction an array of
+    masks, one per square. For an empty square the mask has the bits of the
+    letters that fit the cross word, plus the ANCHOR and CROSS flags; a free
+    square (not an anchor) allows ALL_BITS, and a tile or border allows
+    nothing. The rows and columns are strided memoryviews of these, so no
+    square is copied. make_play updates the masks in the touched rows and
+    columns, as BoardState does."""
+
+    @timed('CompactBoard')
+    def __init__(self, board, bonus=None):
+        if bonus is None: bonus = BONUS
+        rows = [[sq if not isinstance(sq, anchor) else
+                 '*' if bonus[j][i] == '*' else '.'
+                 for (i, sq) in enumerate(row)]
+                for (j, row) in enumerate(board)]
+        self.height, self.width = len(rows), len(rows[0])
+        self.tiles = bytearray(''.join(map(''.join, rows)), 'ascii')
+        self.bonus = ''.join(row[:self.width]
+                             for row in bonus[:self.height])
+        n = len(self.tiles)
+        self.masks = {ACROSS: array('L', [0]) * n, DOWN: array('L', [0]) * n}
+        # The points of the cross word's letters, where there is one
+        self.crosses = {ACROSS: array('L', [0]) * n, DOWN: array('L', [0]) * n}
+        self.reaches = {}  # see reach
+        for k in range(n):
+            self.update(k)
+
+    def __iter__(self):
+        "The rows, as strings."
+        for j in range(self.height):
+            yield self.tiles[j * self.width:(j + 1) * self.width].decode()
+
+    def lines(self, direction):
+        """Yield (k, tiles, masks) for each line of squares in direction,
+        border to border, where k is the index of its first square."""
+        W, H = self.width, self.height
+        tiles, masks = memoryview(self.tiles), memoryview(
+            self.masks[direction])
+        if direction == ACROSS:
+            for k in range(W, W * (H - 1), W):
+                yield k, tiles[k:k + W], masks[k:k + W]
+        else:
+            for k in range(1, W - 1):
+                yield k, tiles[k::W], masks[k::W]
+
+    def update(self, k):
+        "Recompute the masks and cross points of square k (see set_anchor)."
+        tiles, W = self.tiles, self.width
+        c = tiles[k]
+        if IS_TILE[c] or c == ord('|'):
+            self.masks[ACROSS][k] = self.masks[DOWN][k] = 0
+            return
+        neighbors = (k - W, k + W, k + 1, k - 1)
+        if c != ord('*') and not any(IS_TILE[tiles[n]] for n in neighbors):
+            self.masks[ACROSS][k] = self.masks[DOWN][k] = ALL_BITS
+            return
+        for direction, step in [(ACROSS, W), (DOWN, 1)]:
+            above = below = ''
+            points = 0
+            n = k - step
+            while IS_TILE[tiles[n]]:
+                above = UPPER[tiles[n]] + above
+                points += POINTS[chr(tiles[n])]
+                n -= step
+            n = k + step
+            while IS_TILE[tiles[n]]:
+                below += UPPER[tiles[n]]
+                points += POINTS[chr(tiles[n])]
+                n += step
+            if above or below:
+                mask = ANCHOR | CROSS
+                for L in cross_letters(above + '.' + below):
+                    mask |= BITS[L]
+            else:
+                mask = ANCHOR | ALL_BITS
+            self.masks[direction][k] = mask
+            self.crosses[direction][k] = points
+
+    def all_plays(self, hand):
+        "The same set as all_plays(hand, board), on this board's bonus layout."
+        results = set()
+        for direction, step in [(ACROSS, 1), (DOWN, self.width)]:
+            for k, tiles, masks in self.lines(direction):
+                for start, word in compact_line_plays(hand, tiles, masks):
+                    square = k + start * step
+                    pos = (square % self.width, square // self.width)
+                    results.add((self.score(square, direction, word), pos,
+                                 direction, word))
+        return results
+
+    def best_play(self, hand):
+        "Return the highest-scoring play.  Or None."
+        plays = self.all_plays(hand)
+        return sorted(plays)[-1] if plays else NOPLAY
+
+    def score(self, k, direction, word):
+        """The score of word played from square k in direction, with the
+        cross words that its new tiles make (see calculate_score)."""
+        tiles, bonus, masks = self.tiles, self.bonus, self.masks[direction]
+        crosses = self.crosses[direction]
+        step = 1 if direction == ACROSS else self.width
+        total, crosstotal, word_mult = 0, 0, 1
+        for L in word:
+            if IS_TILE[tiles[k]]:
+                total += POINTS[L]
+            else:
+                b = bonus[k]
+                mult = 3 if b == TW else 2 if b in (DW, '*') else 1
+                points = POINTS[L] * (3 if b == TL else 2 if b == DL else 1)
+                word_mult *= mult
+                total += points
+                if masks[k] & CROSS:
+                    crosstotal += mult * (points + crosses[k])
+            k += step
+        return crosstotal + total * word_mult
+
+    def best_plays(self, hand, k=1):
+        """The k highest plays, highest first: the same list as
+        sorted(self.all_plays(hand), reverse=True)[:k]. Anchors are searched
+        best first, by an upper bound on the score of any play through them
+        (see reach and anchor_bound), until the bound of the next one is
+        below the k-th best score found."""
+        return self.search(hand, k)[0]
+
+    def search(self, hand, k=1, deadline=None, cancel=None):
+        """best_plays, as an anytime search: it stops, even inside an anchor,
+        once time.monotonic() passes deadline or cancel (a threading.Event)
+        is set. Return (the k best plays found, highest first, whether the
+        search finished); if it did, they are the k best."""
+        if k <= 0:
+            return [], True
+        stopped = []
+
+        def stop():
+            if not stopped and (
+                    (deadline is not None and time.monotonic() > deadline) or
+                    (cancel is not None and cancel.is_set())):
+                stopped.append(True)
+            return bool(stopped)
+
+        best = []  # a heap of the k highest plays so far
+        stats = current_stats()
+        # Blanks multiply the branching; a first pass without them is quick
+        # to find good plays, and so a bound that prunes the second pass.
+        tiles_only = hand.replace('_', '')
+        for letters in ([tiles_only, hand]
+                        if tiles_only and tiles_only != hand else [hand]):
+            anchors = self.ranked_anchors(letters)
+            for n, (bound, a, line) in enumerate(anchors):
+                if len(best) == k and bound < best[0][0]:
+                    if stats: stats.count('pruned', len(anchors) - n)
+                    break
+                if stop():
+                    break
+                if stats: stats.count('anchors')
+                direction, step, k0, tiles, masks = line
+                for start, word in compact_line_plays(letters, tiles, masks,
+                                                      [a], stop):
+                    square = k0 + start * step
+                    play = (self.score(square, direction, word),
+                            (square % self.width, square // self.width),
+                            direction, word)
+                    if play in best:
+                        continue
+                    elif len(best) < k:
+                        heapq.heappush(best, play)
+                    elif play > best[0]:
+                        heapq.heapreplace(best, play)
+        return sorted(best, reverse=True), not stopped
+
+    @timed()
+    def ranked_anchors(self, hand):
+        """A list of (bound, a, line) for each anchor, highest bound first:
+        line is (direction, step, k0, tiles, masks), as in lines, and a is
+        the anchor's index in it."""
+        tops = tile_tops(hand)
+        anchors = []
+        for direction, step in [(ACROSS, 1), (DOWN, self.width)]:
+            for k0, tiles, masks in self.lines(direction):
+                line = (direction, step, k0, tiles, masks)
+                left, right = self.reach(direction, k0, len(hand))
+                for a in range(1, len(tiles) - 1):
+                    if masks[a] & ANCHOR:
+                        bound = anchor_bound(left[a - 1][-1], right[a][-1],
+                                             tops)
+                        anchors.append((bound, a, line))
+        anchors.sort(key=lambda anchor: anchor[0], reverse=True)
+        return anchors
+
+    def reach(self, direction, k0, R):
+        """Tables bounding what extending a word in the line from square k0
+        can add. left[p][r] and right[p][r] bound what playing up to r tiles
+        from square p on adds, leftward (over free squares) or rightward:
+        (board letter points, word mult, cross points, cross mult, tiles,
+        DL squares, TL squares). A cross word scores at most its cross
+        points plus cross mult times the best tile's points. The tables are
+        kept until the next make_play."""
+        key = (direction, k0, R)
+        if key not in self.reaches:
+            W = self.width
+            step = 1 if direction == ACROSS else W
+            n = W if direction == ACROSS else self.height
+            gains = [None] * n  # a board letter's points, or a square's gain
+            for p in range(n):
+                k = k0 + p * step
+                c, mask = self.tiles[k], self.masks[direction][k]
+                if IS_TILE[c]:
+                    gains[p] = POINTS[chr(c)]
+                elif mask & ALL_BITS:
+                    b = self.bonus[k]
+                    letter_mult = 3 if b == TL else 2 if b == DL else 1
+                    word_mult = 3 if b == TW else 2 if b in (DW, '*') else 1
+                    if mask & CROSS:
+                        crossing = (word_mult * self.crosses[direction][k],
+                                    word_mult * letter_mult)
+                    else:
+                        crossing = (0, 0)
+                    gains[p] = (word_mult, ) + crossing + (
+                        int(letter_mult == 2), int(letter_mult == 3))
+
+            def extend(gain, rest):
+                "The reach from a square with this gain, given that past it."
+                if isinstance(gain, int):
+                    return [(gain + e[0], ) + e[1:] for e in rest]
+                m0, x0, xm0, d0, t0 = gain
+                return [NO_GAIN] + [
+                    (s, m0 * m, x0 + x, xm0 + xm, used + 1, d0 + d, t0 + t)
+                    for (s, m, x, xm, used, d, t) in rest[:R]]
+
+            nothing = [NO_GAIN] * (R + 1)
+            left, right = [nothing] * n, [nothing] * n
+            for p in range(n - 2, 0, -1):
+                if gains[p] is not None:
+                    right[p] = extend(gains[p], right[p + 1])
+            for p in range(1, n - 1):
+                if (gains[p] is not None and
+                        not self.masks[direction][k0 + p * step] & ANCHOR):
+                    left[p] = extend(gains[p], left[p - 1])
+            self.reaches[key] = (left, right)
+        return self.reaches[key]
+
+    def make_play(self, play):
+        "Put the word down on the board, and update the masks it affects."
+        (score, (i, j), (di, dj), word) = play
+        W, H = self.width, self.height
+        squares = [(i + di * n, j + dj * n) for n in range(len(word))]
+        for (x, y), L in zip(squares, word):
+            self.tiles[y * W + x] = ord(L)
+        self.reaches.clear()
+        for y in set(y for x, y in squares):
+            for k in range(y * W, (y + 1) * W):
+                self.update(k)
+        for x in set(x for x, y in squares):
+            for k in range(x, W * H, W):
+                self.update(k)
+        return self
+
+    def show(self):
+        "Print the board, with its own bonus layout."
+        W = self.width
+        for j in range(self.height):
+            print(' '.join(
+                chr(c) if IS_TILE[c] or c == ord('|') else self.bonus[k]
+                for k, c in enumerate(self.tiles[j * W:(j + 1) * W], j * W)))
+
+
+NO_GAIN = (0, 1, 0, 0, 0, 0, 0)  # the reach of playing nothing
+
+
+def tile_tops(tiles):
+    "A list whose t-th entry is the total points of the t best of these tiles."
+    return [0] + list(itertools.accumulate(
+        sorted((POINTS.get(L, 0) for L in tiles), reverse=True)))
+
+
+def anchor_bound(left, right, tops):
+    """An upper bound on the score of a play through an anchor, from the reach
+    tables' entries (for a full hand) to its left and from it rightward.
+    tops[t] is the total of the t best tiles in hand: the tiles score at
+    most that, plus that of the best of them again on each letter premium
+    square (twice for a triple)."""
+    ls, lm, lx, lxm, lt, ld, ltl = left
+    rs, rm, rx, rxm, rt, rd, rtl = right
+    t = min(lt + rt, len(tops) - 1)
+    triples = ltl + rtl
+    points = (tops[t] + tops[min(ld + rd + triples, t)] +
+              tops[min(triples, t)])
+    return (lx + rx + (lxm + rxm) * tops[min(1, t)] +
+            (points + ls + rs) * lm * rm)
+
+
+def compact_line_plays(hand, tiles, masks, anchors=None, stop=None):
+    """The (start, word) plays in one line of a CompactBoard, given as views
+    of its squares and masks: the same set as gaddag_row_plays would find in
+    that line as a list board. With anchors (indexes into the line), only
+    the plays grown from those anchors. If stop() becomes true, the search
+    ends and the plays found so far are returned."""
+    GADDAG = counted(current_lexicon().gaddag())
+    counts = rack(hand)
+    results = set()
+
+    def fill(node, k):
+        """Yield (L, child) for each way to fill square k from node: the board
+        letter on it, or a tile from the hand that fits (used up while
+        yielded)."""
+        c = tiles[k]
+        if IS_TILE[c]:
+            child = GADDAG.child(node, UPPER[c])
+            if child is not None:
+                yield chr(c), child
+            return
+        mask = masks[k]
+        if not mask:
+            return
+        for L, n in counts.items():
+            if n:
+                counts[L] = n - 1
+                if L == '_':
+                    for l, child in GADDAG.children(node):
+                        if mask & BITS.get(l, 0):
+                            yield l.lower(), child
+                elif mask & BITS.get(L, 0):  # other characters are not tiles
+                    child = GADDAG.child(node, L)
+                    if child is not None:
+                        yield L, child
+                counts[L] = n
+
+    def left(start, end, node, front):
+        "front is on squares start to end; extend it leftward, or turn right."
+        if stop is not None and stop():
+            return
+        c, mask = tiles[start - 1], masks[start - 1]
+        if IS_TILE[c] or (mask and not mask & ANCHOR):
+            for L, child in fill(node, start - 1):
+                left(start - 1, end, child, L + front)
+        if not IS_TILE[c]:
+            node = GADDAG.child(node, SEPARATOR)
+            if node is not None:
+                right(start, end, node, front)
+
+    def right(start, end, node, word):
+        "word is on squares start to end; record it, and extend it rightward."
+        if GADDAG.is_word(node) and not IS_TILE[tiles[end]]:
+            results.add((start, word))
+        if stop is not None and stop():
+            return
+        for L, child in fill(node, end):
+            right(start, end + 1, child, word + L)
+
+    if anchors is None:
+        anchors = [k for k in range(1, len(tiles) - 1) if masks[k] & ANCHOR]
+    for k in anchors:
+        for L, child in fill(GADDAG.root, k):
+            left(k, k + 1, child, L)
+    return results
 
 
 def a_board():
@@ -334,6 +1217,13 @@ def a_board():
     ])
 
 
+def empty_board(bonus=None):
+    "A board with no tiles, the shape of bonus (default BONUS), '*' at the start."
+    if bonus is None: bonus = BONUS
+    return [['|' if b == '|' else '*' if b == '*' else '.' for b in row]
+            for row in bonus]
+
+
 def bonus_template(quadrant):
     "Make a board from the upper-left quadrant."
     return mirror(list(map(mirror, quadrant.split())))
@@ -393,14 +1283,16 @@ def show_best(hand, board):
 
 def timedcall(fn, *args):
     "Call function with args; return the time in seconds and result."
-    t0 = time.clock()
+    t0 = time.perf_counter()
     result = fn(*args)
-    t1 = time.clock()
+    t1 = time.perf_counter()
     return t1 - t0, result
 
 
 def test():
     "tests."
+    WORDS = current_lexicon()
+    PREFIXES = WORDS.prefixes
     assert prefixes('WORD') == ['', 'W', 'WO', 'WOR']
     assert len(WORDS) == 3892
     assert len(PREFIXES) == 6475
@@ -418,6 +1310,32 @@ def test():
         'ID', 'ER', 'QUIT', 'ART', 'AREA', 'EQUID', 'RUE', 'TUI', 'ARE', 'QI',
         'ADEQUATE', 'RUT'
     ]))
+    assert topn('ADEQUAT', set('IRE'), 3) == ['ADEQUATE', 'QUADRATE', 'EQUID']
+    assert longest_words('ADEQUAT', set('IRE'), 2) == ['ADEQUATE', 'QUADRATE']
+    for hand, board_letters in [('ADEQUAT', 'IRE'), ('ABCEHKN', 'ETAOIN'),
+                                ('__CEHKN', 'X'), ('QQ', 'Q'), ('ABC', '')]:
+        words = word_plays(hand, board_letters)
+        assert list(iter_word_plays(hand, board_letters)) == sorted(
+            words, key=lambda w: (-word_score(w), w))
+        assert longest_words(hand, board_letters) == sorted(
+            words, key=lambda w: (-len(w), w))
+        assert list(iter_word_plays(hand, board_letters, POINTS, 0)) == []
+        for n in (1, 3, 10):
+            assert list(itertools.islice(
+                iter_word_plays(hand, board_letters, LENGTHS, n),
+                n)) == longest_words(hand, board_letters, n)
+            assert list(itertools.islice(
+                iter_word_plays(hand, board_letters, POINTS, n),
+                n)) == topn(hand, board_letters, n)
+    # A lexicon used for one request is not kept alive by its memos.
+    import gc
+    import weakref
+    from lexicon import Lexicon, using_lexicon
+    with using_lexicon(Lexicon(['AB', 'ABE', 'BE'])) as lexicon:
+        assert list(iter_word_plays('AB', 'E')) == ['ABE', 'BE']
+        lexicon = weakref.ref(lexicon)
+    gc.collect()
+    assert lexicon() is None
 
     def ok(hand, n, s, d, w):
         result = best_play(hand, list(a_board()))
@@ -428,10 +1346,98 @@ def test():
     assert ok('ABCEHKN', 64, (3, 2), (1, 0), 'BACKBENCH')
     assert ok('_BCEHKN', 62, (3, 2), (1, 0), 'BaCKBENCH')
     assert ok('__CEHKN', 61, (9, 1), (1, 0), 'KiCk')
+    test_board_state()
+    test_rack_cache()
+    assert best_plays('ABCEHKN', list(a_board()), 3) == sorted(
+        all_plays('ABCEHKN', list(a_board())), reverse=True)[:3]
+    assert best_plays('ABCEHKN', list(a_board()), 0) == []
+    for hand in ['abcehkn', 'AB-', 'A?B', '']:  # not tiles are ignored
+        assert best_play(hand, list(a_board())) == best_play(
+            hand, list(a_board()), row_plays)
+    assert best_play('AB-', list(a_board())) == (17, (3, 2), (1, 0), 'BA')
+    test_anytime()
+    with lexicon_pool(2) as pool:
+        for hand in ['ABCEHKN', '__CEHKN']:
+            assert parallel_all_plays(hand, list(a_board()), pool=pool,
+                                      chunks=3) == all_plays(
+                                          hand, list(a_board()))
+    for hand in ['ABCEHKN', '__CEHKN', 'ADEQUAT']:
+        assert all_plays(hand, list(a_board()), gaddag_row_plays) == all_plays(
+            hand, list(a_board()))
+    with collecting() as stats:
+        play = best_play('__CEHKN', list(a_board()))
+    assert play == best_play('__CEHKN', list(a_board()), row_plays)
+    assert stats.calls['best_play'] == stats.calls['CompactBoard'] == 1
+    assert stats.counts['nodes'] > stats.counts['anchors'] > 0
+    assert stats.counts['blanks'] > 0 and stats.counts['pruned'] > 0
+    with collecting() as stats:
+        all_plays('ABCEHKN', list(a_board()))
+    assert stats.calls['transpose'] == 2 and stats.calls['set_anchors'] > 2
+    assert stats.seconds['row_plays'] >= stats.seconds['add_suffixes'] > 0
 
     print('tests pass')
 
 
+def test_anytime():
+    "An anytime search gives what it has when time is up, or when cancelled."
+    board = list(a_board())
+    best = best_play('__CEHKN', board)
+    assert anytime_best_play('__CEHKN', board) == (best, True)
+    assert anytime_best_play('__CEHKN', board, time.monotonic() + 60) == (
+        best, True)
+    assert anytime_best_play('__CEHKN', board, time.monotonic()) == (NOPLAY,
+                                                                      False)
+    cancel = threading.Event()
+    cancel.set()
+    assert anytime_best_play('__CEHKN', board, cancel=cancel)[1] is False
+    # Stopped part way, a search still returns only real plays.
+    calls = itertools.count()
+    k0, tiles, masks = next(CompactBoard(board).lines(ACROSS))
+    plays = compact_line_plays('__CEHKN', tiles, masks,
+                               stop=lambda: next(calls) > 200)
+    assert plays and plays < compact_line_plays('__CEHKN', tiles, masks)
+
+
+def test_rack_cache():
+    "Racks with the same tiles share an entry; old entries are evicted."
+    cache = RackCache(maxsize=2)
+    assert cache.get('words', 'TEA', find_words_uncached) == find_words('ATE')
+    assert cache.get('words', 'EAT', find_words_uncached) is cache.get(
+        'words', 'ATE', find_words_uncached)
+    assert isinstance(find_prefixes('ABC'), frozenset)
+    cache.get('words', 'DOG', find_words_uncached)
+    cache.get('words', 'CAT', find_words_uncached)
+    assert cache.info() == dict(hits=2, misses=3, size=2, maxsize=2)
+    cache.get('words', 'ATE', find_words_uncached)  # was evicted
+    assert cache.info()['misses'] == 4
+    cache.resize(1)
+    assert cache.info()['size'] == 1
+
+
+def test_board_state():
+    "A BoardState finds the same plays as all_plays, move after move."
+    board = empty_board()
+    state = BoardState(empty_board())
+    compact = CompactBoard(empty_board())
+    gaddag_state = BoardState(empty_board(SCRABBLE), SCRABBLE, gaddag_row_plays)
+    for hand in ['ABCEHKN', 'AEINRST', '_ETAOIN', 'SHROUDT', 'DRAMITC']:
+        plays = state.all_plays(hand)
+        assert plays == all_plays(hand, [row[:] for row in board])
+        assert compact.all_plays(hand) == plays
+        assert gaddag_state.all_plays(hand) == all_plays(
+            hand, [row[:] for row in gaddag_state.board], None, SCRABBLE)
+        gaddag_state.make_play(max(gaddag_state.all_plays(hand)))
+        play = max(plays)
+        make_play(play, board)
+        state.make_play(play)
+        compact.make_play(play)
+        assert compact.best_plays('AEIRST_', 5) == sorted(
+            compact.all_plays('AEIRST_'), reverse=True)[:5]
+    assert list(compact) == [''.join(row) for row in board]
+    assert [[sq for sq in row if is_letter(sq)] for row in state.board] == [
+        [sq for sq in row if is_letter(sq)] for row in board]
+
+
 def test_words():
     hands = {  ## Regression test
     'ABECEDR': set(['BE', 'CARE', 'BAR', 'BA', 'ACE', 'READ', 'CAR', 'DE', 'BED', 'BEE',
@@ -490,7 +1496,9 @@ def test_words():
     assert removed('LETTERS', 'T') == 'LETERS'
     assert removed('LETTERS', 'SET') == 'LTER'
     assert removed('LETTERS', 'SETTER') == 'L'
-    t, results = timedcall(map, find_words, hands)
+    t, results = timedcall(list, map(find_words_uncached, hands))
+    assert find_words_batch(list(hands)) == list(hands.values())
+    assert list(map(lexicon_words, hands)) == list(hands.values())
     for ((hand, expected), got) in zip(hands.items(), results):
         assert got == expected, "For %r: got %s, expected %s (diff %s)" % (
             hand, got, expected, expected ^ got)
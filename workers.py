@@ -0,0 +1,69 @@
+'''
+Process pools for the word games.
+
+Each worker is handed the current lexicon once, when it starts. Lexicons
+pickle by filename, so a worker loads (or maps) the file itself and no
+task ever carries the lexicon. ordered_map then streams results back in
+input order, with a bounded number of tasks in flight. On a free-threaded
+Python (no GIL) the workers can be threads, which share everything.
+'''
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from lexicon import current_lexicon, use_lexicon
+
+
+def gil_disabled():
+    "Is this a free-threaded Python, running without the GIL?"
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def lexicon_pool(workers=None, lexicon=None, threads=None):
+    """A pool whose workers all use lexicon (default: the current one). They
+    are threads if threads is true (by default, when the GIL is disabled),
+    else processes."""
+    if lexicon is None:
+        lexicon = current_lexicon()
+    if threads is None:
+        threads = gil_disabled()
+    executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    return executor(workers, initializer=use_lexicon, initargs=(lexicon, ))
+
+
+def ordered_map(pool, fn, items, window=None):
+    """Generate fn(*args) for each args tuple in items, computed in pool, in
+    the order of items. At most window tasks (default: 4 per CPU) are
+    submitted ahead of the one being waited for, so memory stays bounded
+    however long items is. Unstarted tasks are cancelled if the caller
+    stops early."""
+    if window is None:
+        window = 4 * (os.cpu_count() or 1)
+    pending = deque()
+    try:
+        for args in items:
+            pending.append(pool.submit(fn, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def test():
+    "tests."
+    with lexicon_pool(2) as pool:
+        assert list(ordered_map(pool, pow, [(2, n) for n in range(20)],
+                                window=3)) == [2**n for n in range(20)]
+        assert list(ordered_map(pool, len, [])) == []
+    with lexicon_pool(2, threads=True) as pool:
+        assert list(ordered_map(pool, pow, [(3, 2)])) == [9]
+    print('tests pass')
+
+
+if __name__ == '__main__':
+    test()